@@ -0,0 +1,56 @@
+"""Microbenchmark: rank-bm25 (used by LangChain's BM25Retriever) vs engines.bm25.SparseBM25Index.
+
+Usage: python benchmarks/bm25_bench.py [n_docs ...]
+"""
+import sys, pathlib, random, time
+
+repo_root = pathlib.Path(__file__).resolve().parent.parent
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+from rank_bm25 import BM25Okapi
+
+from engines.bm25 import SparseBM25Index, tokenize
+
+
+def make_corpus(n_docs: int, vocab_size: int = 20000, doc_len: int = 250, seed: int = 0):
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    weights = [1.0 / (i + 1) for i in range(vocab_size)]  # Zipf-ish, like real text
+    return [" ".join(rng.choices(vocab, weights, k=doc_len)) for _ in range(n_docs)]
+
+
+def bench(n_docs: int, n_queries: int = 50) -> None:
+    docs = make_corpus(n_docs)
+    rng = random.Random(1)
+    queries = [" ".join(rng.sample(docs[rng.randrange(n_docs)].split(), 6)) for _ in range(n_queries)]
+
+    t0 = time.perf_counter()
+    okapi = BM25Okapi([tokenize(d) for d in docs])
+    build_rank = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for q in queries:
+        okapi.get_scores(tokenize(q))
+    query_rank = (time.perf_counter() - t0) / n_queries
+
+    t0 = time.perf_counter()
+    index = SparseBM25Index()
+    index.add([str(i) for i in range(n_docs)], docs)
+    index.search(queries[0])  # weights are built lazily on first query
+    build_sparse = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(q, 16)
+    query_sparse = (time.perf_counter() - t0) / n_queries
+
+    print(
+        f"docs={n_docs:>6}  build rank-bm25={build_rank:6.2f}s sparse={build_sparse:6.2f}s  "
+        f"query rank-bm25={query_rank * 1e3:8.2f}ms sparse={query_sparse * 1e3:7.2f}ms  "
+        f"speedup={query_rank / max(query_sparse, 1e-9):6.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 5000, 20000]
+    for n in sizes:
+        bench(n)
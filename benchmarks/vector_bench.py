@@ -0,0 +1,69 @@
+"""Microbenchmark: Chroma (SQLite + HNSW) vs engines.flat.FlatVectorStore (exact, NumPy).
+
+Build time, single-query and batched-query latency, and Chroma's recall@k against the
+exact flat result, on random unit vectors of OpenAI's embedding size.
+
+Usage: python benchmarks/vector_bench.py [n_chunks ...]
+"""
+import sys, pathlib, time, uuid
+
+import numpy as np
+
+repo_root = pathlib.Path(__file__).resolve().parent.parent
+if str(repo_root) not in sys.path:
+    sys.path.insert(0, str(repo_root))
+
+import chromadb
+
+from engines.flat import FlatVectorStore
+
+DIM = 1536
+K = 16
+
+
+def make_vectors(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    mat = rng.standard_normal((n, DIM), dtype=np.float32)
+    return mat / np.linalg.norm(mat, axis=1, keepdims=True)
+
+
+def bench(n: int, n_queries: int = 100) -> None:
+    vectors = make_vectors(n)
+    queries = make_vectors(n_queries, seed=1)
+    ids = [str(i) for i in range(n)]
+
+    t0 = time.perf_counter()
+    flat = FlatVectorStore(embedding=None)
+    flat.add_vectors(ids, vectors, [{"child": i} for i in range(n)])
+    build_flat = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    exact = [[r for r, _ in flat.search_vectors(q, K)] for q in queries]
+    query_flat = (time.perf_counter() - t0) / n_queries
+    t0 = time.perf_counter()
+    flat.search_batch(queries, K)
+    batch_flat = (time.perf_counter() - t0) / n_queries
+
+    t0 = time.perf_counter()
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(f"bench_{uuid.uuid4().hex[:8]}")
+    step = client.get_max_batch_size()
+    for i in range(0, n, step):
+        collection.add(ids=ids[i:i + step], embeddings=vectors[i:i + step].tolist(), metadatas=[{"child": j} for j in range(i, min(n, i + step))])
+    build_chroma = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    approx = [[int(c) for c in collection.query(query_embeddings=[q.tolist()], n_results=K)["ids"][0]] for q in queries]
+    query_chroma = (time.perf_counter() - t0) / n_queries
+    client.delete_collection(collection.name)
+
+    recall = np.mean([len(set(a) & set(e)) / K for a, e in zip(approx, exact)])
+    print(
+        f"chunks={n:>6}  build chroma={build_chroma:6.2f}s flat={build_flat:6.2f}s  "
+        f"query chroma={query_chroma * 1e3:7.2f}ms flat={query_flat * 1e3:7.2f}ms flat-batched={batch_flat * 1e3:6.2f}ms  "
+        f"chroma recall@{K}={recall:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    for n in sizes:
+        bench(n)
@@ -0,0 +1,189 @@
+import re
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class SparseBM25Index:
+    """Okapi BM25 over a SciPy term-document matrix.
+
+    Raw term counts live in a CSR matrix (one row per document) that grows by `vstack` on
+    `add`; removed rows are masked and compacted lazily. BM25 weights — IDF times the
+    length-normalised tf saturation — are precomputed into a CSC matrix, so a query is one
+    sparse product over the columns of its terms instead of a Python loop over documents.
+    IDF uses the non-negative Lucene form log(1 + (N - df + 0.5) / (df + 0.5)).
+    Updates and queries are serialised by a lock, so documents can be added while serving.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self._row: Dict[str, int] = {}
+        self._tf = sp.csr_matrix((0, 0), dtype=np.float32)
+        self._len = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._df = np.zeros(0, dtype=np.int64)
+        self._weights = None  # CSC, rebuilt lazily after add/remove
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    def nbytes(self) -> int:
+        """Bytes held by the count/weight matrices and per-document arrays (vocab dict excluded)."""
+        total = self._len.nbytes + self._alive.nbytes + self._df.nbytes
+        for m in (self._tf, self._weights):
+            if m is not None:
+                total += m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+        return int(total)
+
+    # ------------------------------ updates --------------------------------
+    def add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        """Index new documents; re-adding an existing id replaces it."""
+        with self._lock:
+            self._add(ids, texts)
+
+    def _add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        replaced = [i for i in ids if i in self._row]
+        if replaced:
+            self._remove(replaced)
+
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            counts: Dict[int, int] = {}
+            for tok in tokenize(text):
+                col = self.vocab.setdefault(tok, len(self.vocab))
+                counts[col] = counts.get(col, 0) + 1
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+
+        n_vocab = len(self.vocab)
+        new = sp.csr_matrix(
+            (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int32)),
+            shape=(len(texts), n_vocab),
+        )
+        old = self._tf
+        old = sp.csr_matrix((old.data, old.indices, old.indptr), shape=(old.shape[0], n_vocab))
+        self._tf = sp.vstack([old, new], format="csr")
+
+        df = np.zeros(n_vocab, dtype=np.int64)
+        df[: self._df.shape[0]] = self._df
+        df += np.bincount(new.indices, minlength=n_vocab)
+        self._df = df
+
+        start = len(self.ids)
+        for offset, doc_id in enumerate(ids):
+            self._row[doc_id] = start + offset
+        self.ids.extend(ids)
+        self._len = np.concatenate([self._len, np.asarray(new.sum(axis=1)).ravel().astype(np.float32)])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._weights = None
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._remove(ids)
+
+    def _remove(self, ids: Iterable[str]) -> None:
+        rows = [self._row.pop(i) for i in ids if i in self._row]
+        if not rows:
+            return
+        gone = self._tf[rows]
+        self._df -= np.bincount(gone.indices, minlength=self._df.shape[0])
+        self._alive[rows] = False
+        if (~self._alive).sum() > 0.25 * len(self._alive):
+            self._compact()
+        self._weights = None
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._alive)
+        self._tf = self._tf[keep]
+        self._len = self._len[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self.ids = [self.ids[r] for r in keep]
+        self._row = {doc_id: r for r, doc_id in enumerate(self.ids)}
+
+    def _build_weights(self) -> None:
+        tf = self._tf
+        n_docs = int(self._alive.sum())
+        avgdl = float(self._len[self._alive].mean()) if n_docs else 1.0
+        idf = np.log1p((n_docs - self._df + 0.5) / (self._df + 0.5)).astype(np.float32)
+
+        rows = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+        norm = self.k1 * (1.0 - self.b + self.b * self._len / max(avgdl, 1e-9))
+        w = idf[tf.indices] * tf.data * (self.k1 + 1.0) / (tf.data + norm[rows])
+        w[~self._alive[rows]] = 0.0
+        self._weights = sp.csr_matrix((w.astype(np.float32), tf.indices, tf.indptr), shape=tf.shape).tocsc()
+
+    # ------------------------------ snapshot -------------------------------
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            if self._weights is None:
+                self._build_weights()
+            w = self._weights
+            return {
+                "ids": np.array(self.ids, dtype=str),
+                "vocab": np.array(sorted(self.vocab, key=self.vocab.__getitem__), dtype=str),
+                "tf_data": self._tf.data, "tf_indices": self._tf.indices, "tf_indptr": self._tf.indptr,
+                "w_data": w.data, "w_indices": w.indices, "w_indptr": w.indptr,
+                "len": self._len, "alive": self._alive, "df": self._df,
+                "params": np.array([self.k1, self.b, self._tf.shape[0], self._tf.shape[1]], dtype=np.float64),
+            }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "SparseBM25Index":
+        """Inverse of `to_arrays`; the matrices keep referencing (possibly memory-mapped) input arrays."""
+        k1, b, n_rows, n_cols = arrays["params"].tolist()
+        index = cls(k1=k1, b=b)
+        shape = (int(n_rows), int(n_cols))
+        index.ids = arrays["ids"].tolist()
+        index.vocab = {term: col for col, term in enumerate(arrays["vocab"].tolist())}
+        index._tf = sp.csr_matrix((arrays["tf_data"], arrays["tf_indices"], arrays["tf_indptr"]), shape=shape, copy=False)
+        index._weights = sp.csc_matrix((arrays["w_data"], arrays["w_indices"], arrays["w_indptr"]), shape=shape, copy=False)
+        # Small per-row/per-term arrays are updated in place by add/remove, so they are copied
+        index._len = np.array(arrays["len"], dtype=np.float32)
+        index._alive = np.array(arrays["alive"], dtype=bool)
+        index._df = np.array(arrays["df"], dtype=np.int64)
+        index._row = {doc_id: r for r, doc_id in enumerate(index.ids) if index._alive[r]}
+        return index
+
+    # ------------------------------- query ---------------------------------
+    def scores(self, query: str) -> np.ndarray:
+        with self._lock:
+            return self._scores(query)
+
+    def _scores(self, query: str) -> np.ndarray:
+        if self._weights is None:
+            self._build_weights()
+        cols: Dict[int, float] = {}
+        for tok in tokenize(query):
+            col = self.vocab.get(tok)
+            if col is not None:
+                cols[col] = cols.get(col, 0.0) + 1.0
+        if not cols:
+            return np.zeros(self._tf.shape[0], dtype=np.float32)
+        sub = self._weights[:, list(cols)]
+        return np.asarray(sub @ np.fromiter(cols.values(), dtype=np.float32)).ravel()
+
+    def search(self, query: str, k: int = 16) -> List[Tuple[str, float]]:
+        with self._lock:
+            scores = self._scores(query)
+            hits = np.flatnonzero(scores > 0)
+            if hits.size == 0:
+                return []
+            if hits.size > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.argsort(-scores[hits])]
+            return [(self.ids[r], float(scores[r])) for r in hits]
+
@@ -0,0 +1,231 @@
+import os
+import json
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+
+def default_cache_root() -> str:
+    """Per-user cache directory (created 0700): pickled entries must not come from other users."""
+    root = os.getenv("ENGINE_CACHE_DIR") or os.path.join(
+        os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "oraculum"
+    )
+    os.makedirs(root, mode=0o700, exist_ok=True)
+    return root
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def corpus_hash(datas: Iterable[bytes]) -> str:
+    """Order-independent id of a set of files: hash of their sorted content hashes."""
+    return corpus_id(sha256_hex(d) for d in datas)
+
+
+def corpus_id(file_hashes: Iterable[str]) -> str:
+    """`corpus_hash` from already computed per-file sha256 hex digests."""
+    return sha256_hex("".join(sorted(file_hashes)).encode("ascii"))
+
+
+class PartitionCache:
+    """On-disk cache of `partition_pdf` output, keyed by PDF bytes + partition parameters.
+
+    One pickle per document under `root`; safe to share between processes (atomic renames)
+    and survives restarts. Entries not owned by the current user are never unpickled. Least-recently-used entries are evicted once the directory grows
+    beyond `max_bytes`.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None) -> None:
+        self.root = root or os.path.join(default_cache_root(), "partitions")
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("PARTITION_CACHE_MAX_MB", "2048")) * 1024 * 1024
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+
+    def key(self, data: bytes, params: Dict[str, Any]) -> str:
+        params_hash = sha256_hex(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return f"{sha256_hex(data)}-{params_hash[:16]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.pkl")
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                if hasattr(os, "getuid") and os.fstat(fh.fileno()).st_uid != os.getuid():
+                    print(f"[WARN] ignoring partition cache entry {key} owned by another user")
+                    return None  # never unpickle a file someone else could have written
+                entry = pickle.load(fh)
+            os.utime(path)  # mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[WARN] dropping unreadable partition cache entry {key}: {e}")
+            self._remove(path)
+            return None
+        return entry.get("chunks")
+
+    def put(self, key: str, chunks: List[Any], source: str = "") -> None:
+        path = self._path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump({"chunks": chunks, "source": source, "created": time.time()}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[WARN] could not write partition cache entry {key}: {e}")
+            self._remove(tmp)
+            return
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least-recently-used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class EmbeddingCache:
+    """SQLite map of (model name, text hash) -> float32 vector, shared across processes."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.path.join(default_cache_root(), "embeddings.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, hash TEXT NOT NULL, vec BLOB NOT NULL,"
+                " PRIMARY KEY (model, hash))"
+            )
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return sha256_hex(text.encode("utf-8"))
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+                batch = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, items: Sequence[Tuple[str, Sequence[float]]]) -> None:
+        rows = [(model, h, array("f", vec).tobytes()) for h, vec in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, hash, vec) VALUES (?, ?, ?)", rows)
+
+
+class SummaryCache:
+    """SQLite map of (model, prompt hash, chunk hash) -> LLM summary, shared across processes."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or os.path.join(default_cache_root(), "summaries.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                " model TEXT NOT NULL, prompt TEXT NOT NULL, hash TEXT NOT NULL, summary TEXT NOT NULL,"
+                " PRIMARY KEY (model, prompt, hash))"
+            )
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return sha256_hex(text.encode("utf-8"))
+
+    def get_many(self, model: str, prompt_hash: str, hashes: Sequence[str]) -> Dict[str, str]:
+        found: Dict[str, str] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for i in range(0, len(unique), 500):
+                batch = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT hash, summary FROM summaries WHERE model = ? AND prompt = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model, prompt_hash, *batch],
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, model: str, prompt_hash: str, items: Sequence[Tuple[str, str]]) -> None:
+        rows = [(model, prompt_hash, h, summary) for h, summary in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO summaries (model, prompt, hash, summary) VALUES (?, ?, ?, ?)", rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the `EmbeddingCache` to `inner`."""
+
+    def __init__(self, inner: Embeddings, cache: Optional[EmbeddingCache] = None, model: Optional[str] = None) -> None:
+        self.inner = inner
+        self.cache = cache or EmbeddingCache()
+        self.model = model or getattr(inner, "model", None) or type(inner).__name__
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        hashes = [EmbeddingCache.text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model, hashes)
+        return [found.get(h) for h in hashes]
+
+    def store(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        self.cache.put_many(self.model, [(EmbeddingCache.text_hash(t), v) for t, v in zip(texts, vectors)])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.lookup(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = self.inner.embed_documents(unique)
+            self.store(unique, fresh)
+            by_text = dict(zip(unique, fresh))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return vectors  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
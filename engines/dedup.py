@@ -0,0 +1,98 @@
+import re
+import hashlib
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+
+_DIGITS_RE = re.compile(r"\d+")
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+# "Page 12", "page 12 of 200" (after punctuation is folded)
+_PAGE_NUMBER_RE = re.compile(r"^page \d+( of \d+)?$")
+_FIGURES_RE = re.compile(r"^[\d ]+$")
+
+
+def normalize(text: str, fold_digits: bool = False) -> str:
+    """Case, whitespace and punctuation folded away; digits too only when `fold_digits`.
+
+    Figures are content ("Revenue 1,234.5" != "Revenue 45.2"), so digits are kept unless the
+    element is a page number or sits in a header/footer zone, where "Page 12" == "Page 13".
+    """
+    text = " ".join(_NON_WORD_RE.sub(" ", (text or "").lower()).split())
+    if fold_digits or _PAGE_NUMBER_RE.match(text):
+        text = " ".join(_DIGITS_RE.sub("#", text).split())
+    return text
+
+
+class BoilerplateFilter:
+    """Collapses running headers, footers, page numbers and repeated disclaimers.
+
+    Only short elements (`max_chars`) are considered. Each one is keyed by the hash of its
+    normalized text; a key seen on at least `min_pages` distinct (source, page) pairs is
+    boilerplate and keeps a single representative. Digits are folded only for page-number
+    patterns and for elements `in_margin` (running headers/footers), so body lines that
+    differ in their figures never share a key. Elements that normalize to nothing
+    (separators) are dropped outright; bare figures ("2023") outside the margins are always
+    kept. Counts persist across calls, so the filter works
+    batch by batch during a streaming build.
+    """
+
+    def __init__(self, max_chars: int = 300, min_pages: int = 3) -> None:
+        self.max_chars = max_chars
+        self.min_pages = min_pages
+        self._pages: Dict[str, Set[Tuple[str, Any]]] = {}
+        self._kept: Set[str] = set()  # short-element keys with at least one indexed occurrence
+        self.removed = 0
+        self.removed_chars = 0
+        self.removed_empty = 0
+
+    @staticmethod
+    def key(normalized: str) -> str:
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).hexdigest()
+
+    def filter(
+        self,
+        elements: Sequence[Any],
+        sources: Sequence[str],
+        text_of: Callable[[Any], str],
+        page_of: Callable[[Any], Optional[int]],
+        in_margin: Optional[Callable[[Any], bool]] = None,
+    ) -> List[int]:
+        """Indices of `elements` to keep, in order; `in_margin` flags header/footer elements."""
+        keys: List[Optional[str]] = []
+        texts: List[str] = []
+        for el, source in zip(elements, sources):
+            text = text_of(el)
+            texts.append(text)
+            if len(text) > self.max_chars:
+                keys.append(None)
+                continue
+            margin = in_margin is not None and in_margin(el)
+            norm = normalize(text, fold_digits=margin)
+            if not margin and _FIGURES_RE.match(norm):  # table headers, years, totals
+                keys.append(None)
+                continue
+            k = self.key(norm) if norm else ""
+            keys.append(k)
+            if k:
+                self._pages.setdefault(k, set()).add((source, page_of(el)))
+
+        keep: List[int] = []
+        for i, k in enumerate(keys):
+            if k is None:
+                keep.append(i)
+                continue
+            if k and (len(self._pages[k]) < self.min_pages or k not in self._kept):
+                self._kept.add(k)
+                keep.append(i)
+                continue
+            self.removed += 1
+            self.removed_chars += len(texts[i])
+            self.removed_empty += int(not k)
+        return keep
+
+    def report(self) -> Dict[str, int]:
+        return {
+            "dedup_removed": self.removed,
+            "dedup_removed_chars": self.removed_chars,
+            "dedup_removed_empty": self.removed_empty,
+            "dedup_boilerplate_groups": sum(len(p) >= self.min_pages for p in self._pages.values()),
+        }
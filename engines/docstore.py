@@ -0,0 +1,206 @@
+import os
+import json
+import uuid
+import zlib
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+from engines.caches import default_cache_root
+
+try:
+    import zstandard as zstd
+except ImportError:  # optional: fall back to zlib
+    zstd = None
+
+
+def _codec() -> Tuple[str, Any, Any]:
+    if zstd is not None:
+        return "zstd", zstd.ZstdCompressor(level=6).compress, zstd.ZstdDecompressor().decompress
+    return "zlib", lambda b: zlib.compress(b, 6), zlib.decompress
+
+
+class _SharedLRU:
+    """Process-wide LRU of decoded parents, bounded in bytes of text across all disk docstores."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Tuple[str, str], Tuple[Document, int]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[Document]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple[str, str], doc: Document) -> None:
+        size = len(doc.page_content) + 64
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._items[key] = (doc, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, dropped) = self._items.popitem(last=False)
+                self._size -= dropped
+
+    def drop(self, store: str, keys: Optional[Sequence[str]] = None) -> None:
+        with self._lock:
+            victims = [k for k in self._items if k[0] == store] if keys is None else [(store, k) for k in keys]
+            for k in victims:
+                entry = self._items.pop(k, None)
+                if entry is not None:
+                    self._size -= entry[1]
+
+    def nbytes(self, store: Optional[str] = None) -> int:
+        with self._lock:
+            if store is None:
+                return self._size
+            return sum(size for (s, _), (_, size) in self._items.items() if s == store)
+
+
+LRU = _SharedLRU(int(os.getenv("DOCSTORE_CACHE_MB", "64")) * 1024 * 1024)
+
+
+class DiskDocStore(BaseStore[str, Document]):
+    """Parent docstore persisted to SQLite, zstd-compressed (zlib without `zstandard`).
+
+    Each parent is one row: id, type, source and the compressed JSON of text + metadata.
+    Recently read parents are served from `LRU`, a byte-bounded tier shared by every disk
+    docstore in the process (`DOCSTORE_CACHE_MB`), so resident memory stays flat however
+    many reports are loaded. The database lives under the cache root and is deleted when
+    the store is closed or garbage-collected, unless an explicit `path` is given.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._owned = path is None
+        if path is None:
+            root = os.path.join(default_cache_root(), "docstores")
+            os.makedirs(root, exist_ok=True)
+            path = os.path.join(root, f"{uuid.uuid4().hex}.sqlite3")
+        self.path = path
+        self._token = uuid.uuid4().hex  # this store's namespace in the shared LRU
+        self.codec, self._compress, self._decompress = _codec()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS parents ("
+                " id TEXT PRIMARY KEY, type TEXT, source TEXT, body BLOB NOT NULL)"
+            )
+        self._finalizer = weakref.finalize(self, DiskDocStore._cleanup, self._conn, self._token, path if self._owned else None)
+
+    @staticmethod
+    def _cleanup(conn: sqlite3.Connection, token: str, path: Optional[str]) -> None:
+        LRU.drop(token)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        if path:
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parents").fetchone()[0]
+
+    def _encode(self, doc: Document) -> bytes:
+        return self._compress(json.dumps({"t": doc.page_content, "m": doc.metadata or {}}).encode("utf-8"))
+
+    def _decode(self, blob: bytes) -> Document:
+        body = json.loads(self._decompress(blob))
+        return Document(page_content=body["t"], metadata=body["m"])
+
+    def count(self, kind: Optional[str] = None) -> int:
+        if kind is None:
+            return len(self)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parents WHERE type = ?", (kind,)).fetchone()[0]
+
+    # ------------------------------ BaseStore ------------------------------
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        me = self._token
+        found: Dict[str, Document] = {}
+        missing = []
+        for key in keys:
+            doc = LRU.get((me, key))
+            if doc is None:
+                missing.append(key)
+            else:
+                found[key] = doc
+        if missing:
+            unique = list(dict.fromkeys(missing))
+            with self._lock:
+                for i in range(0, len(unique), 500):
+                    batch = unique[i:i + 500]
+                    rows = self._conn.execute(
+                        f"SELECT id, body FROM parents WHERE id IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[key] = self._decode(blob)
+            for key in unique:
+                if key in found:
+                    LRU.put((me, key), found[key])
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        rows = [
+            (key, (doc.metadata or {}).get("type"), (doc.metadata or {}).get("source"), self._encode(doc))
+            for key, doc in key_value_pairs
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO parents (id, type, source, body) VALUES (?, ?, ?, ?)", rows)
+        LRU.drop(self._token, [key for key, _ in key_value_pairs])
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        keys = list(keys)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM parents WHERE id = ?", [(k,) for k in keys])
+        LRU.drop(self._token, keys)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        with self._lock:
+            if prefix is None:
+                rows = self._conn.execute("SELECT id FROM parents").fetchall()
+            else:
+                rows = self._conn.execute("SELECT id FROM parents WHERE id LIKE ? || '%'", (prefix,)).fetchall()
+        for (key,) in rows:
+            yield key
+
+    # ------------------------------- memory --------------------------------
+    def nbytes(self) -> Dict[str, int]:
+        return {"lru_tier": LRU.nbytes(self._token)}
+
+    def disk_bytes(self) -> int:
+        total = 0
+        for suffix in ("", "-wal"):
+            try:
+                total += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return total
+
+    def close(self) -> None:
+        self._finalizer()
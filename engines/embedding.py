@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from engines.caches import CachedEmbeddings
+
+
+# OpenAI /embeddings limits: 2048 inputs and 300k tokens per request, 8191 tokens per input.
+# langchain's OpenAIEmbeddings re-chunks at 1000 inputs, so stay at that to keep one request per batch.
+MAX_BATCH_ITEMS = 1000
+MAX_BATCH_TOKENS = 250_000
+MAX_INPUT_TOKENS = 8191
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+
+_encoding = None
+
+
+def _encoder():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return _encoding
+
+
+def count_tokens(texts: Sequence[str]) -> List[int]:
+    return [min(len(toks), MAX_INPUT_TOKENS) for toks in _encoder().encode_ordinary_batch(list(texts))]
+
+
+def pack_batches(
+    token_counts: Sequence[int],
+    max_tokens: int = MAX_BATCH_TOKENS,
+    max_items: int = MAX_BATCH_ITEMS,
+) -> List[List[int]]:
+    """Greedily pack item indices into batches under both the token and the item limit."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_tokens = 0
+    for i, n in enumerate(token_counts):
+        if cur and (cur_tokens + n > max_tokens or len(cur) >= max_items):
+            batches.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(i)
+        cur_tokens += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+class TokenBudget:
+    """Sliding one-minute token budget shared by the embedding workers."""
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.tokens_per_minute = tokens_per_minute
+        self._spent: deque = deque()  # (timestamp, tokens)
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, tokens: int) -> None:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._spent and now - self._spent[0][0] >= 60:
+                    self._used -= self._spent.popleft()[1]
+                # a single oversized batch is let through once the window is empty
+                if self._used + tokens <= self.tokens_per_minute or not self._spent:
+                    self._spent.append((now, tokens))
+                    self._used += tokens
+                    return
+                self._cond.wait(timeout=60 - (now - self._spent[0][0]))
+
+
+def embed_texts(
+    embeddings: Embeddings,
+    texts: Sequence[str],
+    concurrency: int = EMBED_CONCURRENCY,
+    tokens_per_minute: int = EMBED_TPM,
+    stats: Optional[Dict[str, float]] = None,
+) -> List[List[float]]:
+    """Embed `texts` in token-packed batches, several batches in flight at once.
+
+    With a `CachedEmbeddings`, cached vectors are resolved first and only the misses are
+    batched and sent to the wrapped model; fresh vectors are written back to the cache.
+    """
+    texts = list(texts)
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    model: Embeddings = embeddings
+    if isinstance(embeddings, CachedEmbeddings):
+        vectors = embeddings.lookup(texts)
+        model = embeddings.inner
+
+    # Embed each distinct missing text once
+    todo = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings.hits += len(texts) - sum(v is None for v in vectors)
+        embeddings.misses += len(todo)
+
+    fresh: Dict[str, List[float]] = {}
+    if todo:
+        counts = count_tokens(todo)
+        batches = pack_batches(counts)
+        budget = TokenBudget(tokens_per_minute)
+
+        def run(batch: List[int]) -> List[List[float]]:
+            budget.acquire(sum(counts[i] for i in batch))
+            return model.embed_documents([todo[i] for i in batch])
+
+        workers = max(1, min(concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch, outs in zip(batches, pool.map(run, batches)):
+                for i, vec in zip(batch, outs):
+                    fresh[todo[i]] = vec
+
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings.store(list(fresh), list(fresh.values()))
+        if stats is not None:
+            stats["embed_batches"] = stats.get("embed_batches", 0) + len(batches)
+            stats["embed_tokens"] = stats.get("embed_tokens", 0) + sum(counts)
+
+    return [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+
+
+def add_precomputed(
+    vectorstore: Any,
+    ids: Sequence[str],
+    docs: Sequence[Document],
+    vectors: Sequence[Sequence[float]],
+    store_text: bool = True,
+) -> None:
+    """Bulk-upsert documents with already computed vectors into a Chroma or flat vector store.
+
+    With `store_text=False` only vectors and metadata are kept; hits come back with empty
+    `page_content`, for callers that resolve the text from a docstore by id.
+    """
+    if hasattr(vectorstore, "add_vectors"):  # engines.flat.FlatVectorStore
+        texts = [d.page_content for d in docs] if store_text else None
+        vectorstore.add_vectors(list(ids), vectors, [d.metadata for d in docs], texts)
+        return
+    collection = vectorstore._collection
+    try:
+        step = vectorstore._client.get_max_batch_size()
+    except Exception:
+        step = 5000
+    for i in range(0, len(ids), step):
+        collection.upsert(
+            ids=list(ids[i:i + step]),
+            embeddings=[list(v) for v in vectors[i:i + step]],
+            documents=[d.page_content if store_text else "" for d in docs[i:i + step]],
+            metadatas=[d.metadata for d in docs[i:i + step]],
+        )
@@ -1,37 +1,51 @@
 
 import io
+import os
+import re
+import json
+import sys
 import time
 import uuid
-import base64
-import binascii
-from typing import Any, Iterable, List, Optional, Tuple, Dict
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Dict
 
 try:
     import pysqlite3  # bundled modern sqlite
-    import sys
     sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
 except Exception:
     pass
 
 from dotenv import  load_dotenv
-from unstructured.partition.pdf import partition_pdf
+import numpy as np
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.output_parsers import StrOutputParser
 
 from langchain_community.vectorstores import Chroma
-from langchain.storage import InMemoryStore
 from langchain_core.documents import Document
 from langchain.retrievers.multi_vector import MultiVectorRetriever
 
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
 
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.messages import SystemMessage, HumanMessage
 
-from engines.prompts import system_finance_prompt
+from engines.prompts import image_caption_prompt, system_finance_prompt
+from engines.partition import cache_params, iter_partition, page_count, partition_files, read_bytes, split_elements
+from engines.caches import CachedEmbeddings, PartitionCache, corpus_id, sha256_hex
+from engines.embedding import add_precomputed, embed_texts
+from engines.bm25 import SparseBM25Index
+from engines.fusion import FusedRetriever
+from engines.images import ImageStore, ImageTriage, image_payload
+from engines.dedup import BoilerplateFilter
+from engines.records import RecordStore
+from engines.docstore import DiskDocStore
+from engines.hierarchy import ChildIndex, sentence_windows
+from engines.flat import FlatVectorStore
+from engines.snapshot import load_arrays, read_manifest, save_arrays, write_manifest
+from engines.lifecycle import SWEEPER, chroma_client, collection_name, current_session_id, reclaim, rename_collection
 
 
 load_dotenv()
@@ -47,16 +61,83 @@ class HybridEngine:
     - Summarize only *long* chunks; embed short chunks directly (no LLM call).
     - Lower retrieval fanout (k) and cap images included in prompt.
     - Concurrency for LLM summarization.
+    - Multi-file partitioning in a process pool (`workers`).
+    - Page-window sharding of long PDFs across the same pool (`shard_pages`).
+    - On-disk partition cache keyed by PDF hash, so repeat uploads skip OCR (`cache`).
+    - Text-layer pre-pass: digitally born pages without tables, charts or large images skip
+      hi_res OCR (`text_layer`). It runs per page window inside the workers; its cost is
+      `timings["text_layer_prepass_s"]`, already netted out of `text_layer_saved_s`.
+    - SQLite embedding cache keyed by (model, chunk hash), so repeated chunks skip the API.
+    - Token-packed, concurrent embedding batches with a bulk Chroma insert.
+    - `add_file` after `main()` indexes just the new file and extends BM25 in place.
+    - Sparse side is a SciPy CSR BM25 index (engines/bm25.py) instead of rank-bm25.
+    - Dense and sparse lookups run concurrently and are fused by weighted RRF (engines/fusion.py).
+    - Streaming build (`iter_build` / `start_streaming`): queryable after the first page batch.
+    - Images kept as raw bytes in an `ImageStore`, out of BM25/Chroma. Only an image whose own
+      caption was retrieved goes into the prompt; `link_page_images=True` also attaches the
+      images on a retrieved text parent's pages.
+    - Image triage at ingest: tiny icons dropped, repeated logos collapsed by perceptual hash.
+    - Prompt images downscaled/re-encoded once per id before they reach the vision model.
+    - Optional image captions at ingest (`caption_images`): indexed dense + sparse, used as
+      context. Whether or not captions are on, pixels are attached only when the question
+      asks about a figure.
+    - Boilerplate dedup (`dedup`): running headers, footers, page numbers and repeated
+      disclaimers are collapsed to one copy before embedding and BM25.
+    - Parents packed in an array-backed `RecordStore` (one shared text buffer); Chroma keeps
+      vectors + ids only; elements, chunks and upload buffers are freed once indexed.
+      See `memory_report()`.
+    - Small-to-big: sentence-window children are embedded, the surrounding `by_title` chunk
+      is the parent (stored once); child -> parent is an int32 `ChildIndex`.
+    - `docstore="disk"`: parents in zstd-compressed SQLite behind a process-wide, byte-bounded
+      LRU tier (engines/docstore.py) instead of RAM.
+    - `save(path)` / `HybridEngine.load(path)`: versioned snapshot of vectors, parents, child
+      map and BM25 matrices as `.npy` files, memory-mapped back on load (engines/snapshot.py).
+    - `vector_index="flat"`: exact NumPy cosine index (engines/flat.py) instead of Chroma/HNSW;
+      a loaded snapshot then searches the memory-mapped vectors directly.
+    - `vector_dtype="float16"|"int8"` quantizes the flat index; top candidates are re-scored
+      from an on-disk float32 copy (`rescore`). See `vector_report()` for savings and recall.
+    - One Chroma collection per engine, `rag-<corpus hash>-<id>` (renamed as files are added,
+      restored on `load`), in a shared client; dropped by
+      `close()` / `with HybridEngine(...)`, or by the background sweeper once the Streamlit
+      session has ended or the engine sat idle (engines/lifecycle.py).
     - Stage timings exposed in `self.timings`.
     """
 
-    def __init__(self, pdfs: Optional[Iterable[Tuple[io.BytesIO, str]]] = None) -> None:
+    def __init__(
+        self,
+        pdfs: Optional[Iterable[Tuple[io.BytesIO, str]]] = None,
+        workers: int = 1,
+        shard_pages: int = 0,
+        cache: bool = True,
+        text_layer: bool = True,
+        caption_images: bool = False,
+        link_page_images: bool = False,
+        dedup: bool = True,
+        docstore: str = "memory",
+        vector_index: str = "chroma",
+        vector_dtype: str = "float32",
+        rescore: bool = True,
+    ) -> None:
+        pdfs = list(pdfs or [])
         # Inputs
-        self._files: List[Tuple[io.BytesIO, str]] = []
+        self.file_names: List[str] = []
+        self._pending: List[Tuple[io.BytesIO, str]] = []  # added but not yet indexed
+        self._file_hashes: List[str] = []  # sha256 per added file; `corpus_id` derives from them
+        self.corpus_id = corpus_id([])
+        for f_like, name in pdfs:
+            self._queue(f_like, name)
+        self.workers = max(1, int(workers))  # >1 partitions files in a process pool
+        self.shard_pages = max(0, int(shard_pages))  # >0 splits long PDFs into page windows
+        self.partition_cache: Optional[PartitionCache] = PartitionCache() if cache else None
+        self.text_layer = text_layer  # skip OCR on plain-text pages with an embedded text layer
+        self.caption_images = caption_images  # index one caption per image; pixels only on demand
+        self.link_page_images = link_page_images  # text parents also carry their pages' image ids
+        self.caption_model = "gpt-4o-mini"
+        self.boilerplate: Optional[BoilerplateFilter] = BoilerplateFilter() if dedup else None
         self._built: bool = False
         self.timings: Dict[str, float] = {}
 
-        # Extracted elements
+        # Extracted elements (build-only: emptied by `_release` once they are indexed)
         self.chunks: Optional[List[Any]] = None
         self.tables: List[Any] = []
         self.texts: List[Any] = []
@@ -64,11 +145,30 @@ class HybridEngine:
         self.table_sources: List[str] = []
         self.text_sources: List[str] = []
         self.image_sources: List[str] = []
+        self.text_groups: List[int] = []  # by_title chunk ordinal of each text element
+        self._n_chunks = 0
+        self._indexed: Tuple[int, int, int] = (0, 0, 0)  # (tables, texts, images) already in the stores, until released
+        self._new_parents: List[Tuple[str, Document]] = []  # (doc_id, parent) added by the last _store_load
 
 
         # Vector & store
-        self.vectorstore = Chroma(collection_name="multi_modal_rag", embedding_function=OpenAIEmbeddings())
-        self.store = InMemoryStore()
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings()) if cache else OpenAIEmbeddings()
+        # One collection per engine: child ids are plain ordinals into `self.child_index`
+        self.vector_index = vector_index
+        self._instance = uuid.uuid4().hex[:8]
+        self.collection_name = collection_name(self.corpus_id, self._instance)  # follows `corpus_id`
+        SWEEPER.claim(self.collection_name)
+        self._finalizer = weakref.finalize(self, reclaim, self.collection_name)
+        if vector_index == "flat":
+            self.vectorstore = FlatVectorStore(self.embeddings, dtype=vector_dtype, rescore=rescore)
+        else:
+            self.vectorstore = Chroma(client=chroma_client(), collection_name=self.collection_name, embedding_function=self.embeddings)
+        # Parents: in-memory arrays + one shared text buffer, or SQLite on disk with an LRU tier
+        self.store = DiskDocStore() if docstore == "disk" else RecordStore()
+        self.image_store = ImageStore()  # raw image bytes, outside the docstore and text indexes
+        self.image_triage = ImageTriage()  # drops icons, collapses repeated logos
+        self.child_index = ChildIndex()  # vector child ordinal -> parent doc id
+        self.child_window = 3  # sentences per child
         self.id_key = "doc_id"
         self.dense_retriever = MultiVectorRetriever(
             vectorstore=self.vectorstore,
@@ -79,56 +179,114 @@ class HybridEngine:
 
         # Retrievers & chains
         self.hybrid = None
-      
-
-        if pdfs:
-            for f_like, name in pdfs:
-                self.add_file(f_like, name)
-
-    def add_file(self, file_like: io.BytesIO, name: str) -> None:
+        self.sparse_index: Optional[SparseBM25Index] = None
+
+        # Streaming build state (see `iter_build` / `start_streaming`)
+        self.progress: Dict[str, Any] = {"pages_indexed": 0, "pages_total": 0, "done": False, "error": None}
+        self._stream_thread: Optional[threading.Thread] = None
+        self.on_stream_done: List[Any] = []  # callables run when a streaming build ends (e.g. pool budget)
+
+        # Lifecycle (see `close`): the sweeper closes engines of ended sessions or idle too long
+        self.session_id = current_session_id()
+        self.last_used = time.monotonic()
+        self.closed = False
+        self.closing = False  # set by `close()`; resources go once the last `in_use` ends
+        self._users = 0
+        self._use_lock = threading.Lock()
+        SWEEPER.register(self)
+
+    def _queue(self, file_like: io.BytesIO, name: str) -> None:
         try:
             file_like.seek(0)
         except Exception:
             pass
-        self._files.append((file_like, name))
+        self.file_names.append(name)
+        self._pending.append((file_like, name))
+        self._file_hashes.append(sha256_hex(read_bytes(file_like)))
+        self.corpus_id = corpus_id(self._file_hashes)
+
+    def _name_collection(self) -> None:
+        """Rename the collection (and move the sweeper claim) after `corpus_id` changed."""
+        name = collection_name(self.corpus_id, self._instance)
+        if name == self.collection_name:
+            return
+        collection = None if isinstance(self.vectorstore, FlatVectorStore) else self.vectorstore._collection
+        rename_collection(collection, self.collection_name, name)
+        self._finalizer.detach()
+        self.collection_name = name
+        self._finalizer = weakref.finalize(self, reclaim, name)
+
+    def add_file(self, file_like: io.BytesIO, name: str) -> None:
+        """Queue a PDF; on an already built engine it is partitioned and indexed right away."""
+        self._queue(file_like, name)
+        self._name_collection()
+        if self._built:
+            t0 = time.perf_counter()
+            self._ingest()
+            self.timings["add_file_s"] = time.perf_counter() - t0
+
+    def _ingest(self) -> None:
+        """Partition and index the pending files only; the sparse index is extended, not rebuilt."""
+        self._unstructured()
+        self._dedup()
+        self._store_load()
+        self._hydra()
+        self._release()
 
     def _unstructured(self) -> None:
         t0 = time.perf_counter()
-        all_chunks: List[Any] = []
-        tables, texts, images = [], [], []
-        t_src, x_src, i_src = [], [], []
-
-        for f_like, fname in self._files:
-            f_like.seek(0)
-            chunks = partition_pdf(
-                file=f_like,
-                infer_table_structure=False,   
-                strategy="hi_res",             
-                extract_image_block_types=["Image"],
-                extract_image_block_to_payload=True,
-                chunking_strategy="by_title",
-                max_characters=6000,
-                combine_text_under_n_chars=1500,
-                new_after_n_chars=4000,
-            )
-            all_chunks.extend(chunks)
-
-            for chunk in chunks:
-                if hasattr(chunk, "metadata") and getattr(chunk.metadata, "orig_elements", None):
-                    for el in chunk.metadata.orig_elements:
-                        t = str(type(el))
-                        if "Table" in t:
-                            tables.append(el); t_src.append(fname)
-                        elif "Image" in t:
-                            images.append(el); i_src.append(fname)
-                        else:
-                            texts.append(el); x_src.append(fname)
-
-        self.chunks = all_chunks
-        self.tables, self.texts, self.images = tables, texts, images
-        self.table_sources, self.text_sources, self.image_sources = t_src, x_src, i_src
+        files = [(read_bytes(f_like), fname) for f_like, fname in self._pending]
+        self._pending = []
+        results = partition_files(
+            files,
+            workers=self.workers,
+            shard_pages=self.shard_pages,
+            cache=self.partition_cache,
+            text_layer=self.text_layer,
+            stats=self.timings,
+        )
+
+        n_texts, n_tables, n_images = len(self.texts), len(self.tables), len(self.images)
+        for fname, chunks, secs, from_cache in results:
+            self._absorb(fname, chunks, secs, from_cache)
+
         self.timings["unstructured_s"] = time.perf_counter() - t0
-        print(f"Finished unstructured — texts={len(texts)} tables={len(tables)} images={len(images)}")
+        print(
+            f"Finished unstructured — files={len(results)} workers={self.workers} "
+            f"texts={len(self.texts) - n_texts} tables={len(self.tables) - n_tables} images={len(self.images) - n_images}"
+        )
+
+    def _absorb(self, fname: str, chunks: List[Any], secs: float, from_cache: bool) -> None:
+        """Append one file's (or page batch's) chunks and their split elements."""
+        if self.chunks is None:
+            self.chunks = []
+        self.chunks.extend(chunks)
+        key = f"partition_s[{fname}]"
+        self.timings[key] = self.timings.get(key, 0.0) + secs
+        self.timings["partition_cache_hits"] = self.timings.get("partition_cache_hits", 0) + int(from_cache)
+
+        for chunk in chunks:  # one at a time, to remember which by_title chunk each text came from
+            f_tables, f_texts, f_images = split_elements([chunk])
+            self.tables.extend(f_tables); self.table_sources.extend([fname] * len(f_tables))
+            self.texts.extend(f_texts); self.text_sources.extend([fname] * len(f_texts))
+            self.images.extend(f_images); self.image_sources.extend([fname] * len(f_images))
+            self.text_groups.extend([self._n_chunks] * len(f_texts))
+            self._n_chunks += 1
+
+    def _el_page(self, el: Any) -> Optional[int]:
+        return getattr(getattr(el, "metadata", None), "page_number", None)
+
+    def _el_in_margin(self, el: Any, zone: float = 0.08) -> bool:
+        """Header/footer element: so categorized, or within `zone` of the page's top or bottom."""
+        if getattr(el, "category", None) in ("Header", "Footer", "PageNumber"):
+            return True
+        coords = getattr(getattr(el, "metadata", None), "coordinates", None)
+        height = getattr(getattr(coords, "system", None), "height", None)
+        points = getattr(coords, "points", None)
+        if not height or not points:
+            return False
+        ys = [y for _, y in points]
+        return max(ys) < zone * height or min(ys) > (1 - zone) * height
 
     def _el_text(self, el: Any) -> str:
         if hasattr(el, "to_text"):
@@ -136,117 +294,224 @@ class HybridEngine:
         return getattr(el, "text", str(el)) or "" 
 #    part above changed<<<<
 
-    def _store_load(self) -> None:
+    def _dedup(self) -> None:
+        """Drop repeated boilerplate from the not-yet-indexed texts (see engines/dedup.py)."""
+        if self.boilerplate is None:
+            return
         t0 = time.perf_counter()
-        # Texts → vector + parents
-        text_ids = [str(uuid.uuid4()) for _ in self.texts]
+        x_from = self._indexed[1]
+        texts, sources, groups = self.texts[x_from:], self.text_sources[x_from:], self.text_groups[x_from:]
+        keep = self.boilerplate.filter(texts, sources, self._el_text, self._el_page, self._el_in_margin)
+        if len(keep) < len(texts):
+            self.texts[x_from:] = [texts[i] for i in keep]
+            self.text_sources[x_from:] = [sources[i] for i in keep]
+            self.text_groups[x_from:] = [groups[i] for i in keep]
+        self.timings.update(self.boilerplate.report())
+        self.timings["dedup_s"] = self.timings.get("dedup_s", 0.0) + time.perf_counter() - t0
+        print(f"Finished dedup — removed={len(texts) - len(keep)} kept={len(keep)}")
 
-        child_text_docs = [
-            Document(
-            page_content=self._el_text(el),
-            metadata={self.id_key: text_ids[i], "source": self.text_sources[i], "type": "text"}
-            )
-            for i, el in enumerate(self.texts)
-        ]
-        if child_text_docs:
-            print("\n[DEBUG] Adding text docs:")
-            for d in child_text_docs[:5]:
-                print(repr(d.page_content))
-            self.dense_retriever.vectorstore.add_documents(child_text_docs)
-       
-
-        parent_text_docs = [
-            Document(page_content=self._el_text(el), metadata={"source": self.text_sources[i], "type": "text"})
-            for i, el in enumerate(self.texts)
-        ]
+    def _store_load(self) -> None:
+        t0 = time.perf_counter()
+        # Only elements added since the previous load
+        t_from, x_from, i_from = self._indexed
+        tables, table_sources = self.tables[t_from:], self.table_sources[t_from:]
+        texts, text_sources, text_groups = self.texts[x_from:], self.text_sources[x_from:], self.text_groups[x_from:]
+        images, image_sources = self.images[i_from:], self.image_sources[i_from:]
+
+        # Images → out-of-band image store; with `link_page_images`, text parents on the same page point at them by id
+        image_ids: List[str] = []
+        page_images: Dict[Tuple[str, Any], List[str]] = {}
+        for i, el in enumerate(images):
+            payload = image_payload(el)
+            if payload is None:
+                continue
+            page = self._el_page(el)
+            verdict, image_id = self.image_triage.check(payload[0], str(uuid.uuid4()), image_sources[i], page)
+            if verdict == "small":
+                continue
+            if verdict == "keep":
+                self.image_store.put(image_id, *payload)
+                image_ids.append(image_id)
+            linked = page_images.setdefault((image_sources[i], page), [])
+            if image_id not in linked:
+                linked.append(image_id)
+
+        # Captions: searchable text stand-ins for the new images (parent id = image id)
+        caption_ids: List[str] = []
+        child_caption_docs: List[Document] = []
+        parent_caption_docs: List[Document] = []
+        if self.caption_images and image_ids:
+            tc = time.perf_counter()
+            captions = self._caption_images(image_ids)
+            pages = {img: key for key, ids in page_images.items() for img in ids}
+            for image_id, caption in captions.items():
+                source, page = pages[image_id]
+                meta = {"source": source, "type": "image", "image_id": image_id, "page": page}
+                caption_ids.append(image_id)
+                child_caption_docs.append(Document(page_content=caption))
+                parent_caption_docs.append(Document(page_content=caption, metadata=meta))
+            self.timings["images_captioned"] = self.timings.get("images_captioned", 0) + len(captions)
+            self.timings["caption_s"] = self.timings.get("caption_s", 0.0) + time.perf_counter() - tc
+
+        # Texts → parents: the elements of one by_title chunk, joined and stored once
+        groups: Dict[int, List[int]] = {}
+        for i, g in enumerate(text_groups):
+            groups.setdefault(g, []).append(i)
+        text_ids: List[str] = []
+        parent_text_docs: List[Document] = []
+        for members in groups.values():
+            pages = list(dict.fromkeys(self._el_page(texts[i]) for i in members))
+            source = text_sources[members[0]]
+            meta = {"source": source, "type": "text", "page": pages[0]}
+            if self.link_page_images:
+                linked = list(dict.fromkeys(img for p in pages for img in page_images.get((source, p), [])))
+                if linked:
+                    meta["image_ids"] = linked
+            text_ids.append(str(uuid.uuid4()))
+            parent_text_docs.append(Document(page_content="\n\n".join(self._el_text(texts[i]) for i in members), metadata=meta))
         if parent_text_docs:
             self.dense_retriever.docstore.mset(list(zip(text_ids, parent_text_docs)))
 
-        # Tables → vector + parents
-        table_ids = [str(uuid.uuid4()) for _ in self.tables]
-        # Children: raw table chunks → vectorstore (each points to its parent via id_key)
-        child_table_docs = [
-            Document(
-                page_content=self._el_text(el),
-                metadata={self.id_key: table_ids[i], "source": self.table_sources[i], "type": "table"}
-                )
-                for i, el in enumerate(self.tables)
-                ]
-        if child_table_docs:
-            print("\n[DEBUG] Adding table docs:")
-            for d in child_table_docs[:5]:
-                print(repr(d.page_content))
-            self.dense_retriever.vectorstore.add_documents(child_table_docs)
-        
-
-       
+        # Children: sentence windows of each parent, for precise matching
+        windows = [sentence_windows(p.page_content, self.child_window) for p in parent_text_docs]
+        child_text_docs = [Document(page_content=w) for ws in windows for w in ws]
+
+        # Tables → one child each (the table text) + parents
+        table_ids = [str(uuid.uuid4()) for _ in tables]
+        child_table_docs = [Document(page_content=self._el_text(el)) for el in tables]
+
+        # Text + table children → one token-packed, concurrent embedding pass, then a bulk insert
+        children = child_text_docs + child_table_docs + child_caption_docs
+        if children:
+            te = time.perf_counter()
+            vectors = embed_texts(self.embeddings, [d.page_content for d in children], stats=self.timings)
+            owners = (
+                [(doc_id, len(ws)) for doc_id, ws in zip(text_ids, windows)]
+                + [(doc_id, 1) for doc_id in table_ids]
+                + [(doc_id, 1) for doc_id in caption_ids]
+            )
+            ordinals = [c for doc_id, n in owners for c in self.child_index.add(doc_id, n)]
+            for doc, c in zip(children, ordinals):
+                doc.metadata = {"child": c}
+            # Chroma keeps vectors + child ordinal only; the text is served from the docstore
+            add_precomputed(self.vectorstore, [str(c) for c in ordinals], children, vectors, store_text=False)
+            self.timings["embedding_s"] = time.perf_counter() - te
+            self.timings["children"] = len(self.child_index)
 
         parent_table_docs = [
-            Document(page_content=self._el_text(el), metadata={"source": self.table_sources[i], "type": "table"})
-            for i, el in enumerate(self.tables)
+            Document(page_content=self._el_text(el), metadata={"source": table_sources[i], "type": "table"})
+            for i, el in enumerate(tables)
         ]
         if parent_table_docs:
             self.dense_retriever.docstore.mset(list(zip(table_ids, parent_table_docs)))
+        if parent_caption_docs:
+            self.dense_retriever.docstore.mset(list(zip(caption_ids, parent_caption_docs)))
+
+        self.timings["images_stored"] = len(self.image_store)
+        self.timings["images_dropped_small"] = self.image_triage.dropped_small
+        self.timings["images_dropped_duplicate"] = self.image_triage.dropped_duplicate
+        self._indexed = (len(self.tables), len(self.texts), len(self.images))
+        self._new_parents = (
+            list(zip(text_ids, parent_text_docs))
+            + list(zip(table_ids, parent_table_docs))
+            + list(zip(caption_ids, parent_caption_docs))
+        )
 
-        # Images → parents only (cap stored count if huge)
-        image_ids = [str(uuid.uuid4()) for _ in self.images]
-        parent_image_docs: List[Document] = []
-        for i, el in enumerate(self.images):
-            b64 = getattr(el, "payload", None) or getattr(el, "data", None) or ""
-            if not isinstance(b64, str):
-                b64 = str(b64)
-            parent_image_docs.append(Document(page_content=b64, metadata={"source": self.image_sources[i], "type": "image"}))
-        if parent_image_docs:
-            self.dense_retriever.docstore.mset(list(zip(image_ids, parent_image_docs)))
-
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.timings["embedding_cache_hits"] = self.embeddings.hits
+            self.timings["embedding_cache_misses"] = self.embeddings.misses
         self.timings["store_load_s"] = time.perf_counter() - t0
         print("Finished store load")
 
 
+    def _release(self) -> None:
+        """Drop build-only structures once their content is in the stores and indexes."""
+        self.chunks = None
+        self.tables, self.texts, self.images = [], [], []
+        self.table_sources, self.text_sources, self.image_sources = [], [], []
+        self.text_groups = []
+        self._indexed = (0, 0, 0)
+        self._new_parents = []
+
+    def _caption_images(self, image_ids: List[str]) -> Dict[str, str]:
+        """One short caption per image, requested concurrently; failures are skipped."""
+        model = ChatOpenAI(model=self.caption_model, temperature=0)
+        ids, batch = [], []
+        for image_id in image_ids:
+            url = self.image_store.data_url(image_id)
+            if url:
+                ids.append(image_id)
+                batch.append([HumanMessage(content=[
+                    {"type": "text", "text": image_caption_prompt},
+                    {"type": "image_url", "image_url": {"url": url}},
+                ])])
+        outs = model.batch(batch, {"max_concurrency": 8}, return_exceptions=True)
+        captions = {}
+        for image_id, out in zip(ids, outs):
+            if isinstance(out, Exception):
+                print(f"[WARN] caption failed for image {image_id}: {out}")
+                continue
+            text = (out.content or "").strip() if isinstance(out.content, str) else ""
+            if text:
+                captions[image_id] = text
+        return captions
+
     # --- in HybridEngine._hydra ---
     def _hydra(self) -> None:
         t0 = time.perf_counter()
 
+        if self.sparse_index is not None:
+            # Engine already built: only fold the newly loaded parents into the sparse index
+            new = [(doc_id, d) for doc_id, d in self._new_parents if d and d.page_content]
+            if new:
+                self.sparse_index.add([doc_id for doc_id, _ in new], [d.page_content for _, d in new])
+            self.timings["retriever_build_s"] = time.perf_counter() - t0
+            print(f"Finished hydra (incremental) — parents={len(self.sparse_index)} new={len(new)}")
+            return
+
         # Pull parents from the docstore
         keys = list(self.store.yield_keys())
         raw_items = self.store.mget(keys) if keys else []
 
-        parent_docs: List[Document] = []
-        for item in raw_items:
-            if not item:
-                continue
-            parent_docs.append(item if isinstance(item, Document)
-                            else Document(page_content=str(item)))
+        parent_ids: List[str] = []
+        parent_texts: List[str] = []
+        for key, item in zip(keys, raw_items):
+            text = item.page_content if isinstance(item, Document) else str(item or "")
+            if not text:
+                continue  # image pixels live in the image store; only their captions are indexed
+            parent_ids.append(key)
+            parent_texts.append(text)
+
+        if parent_ids:
+            # Vectorized BM25 (CSR term-document matrix) over the parents
+            self.sparse_index = SparseBM25Index()
+            self.sparse_index.add(parent_ids, parent_texts)
+        self._make_hybrid()
 
-        if parent_docs:
-            # BM25 needs at least 1 document; try from_documents and fall back to from_texts for older versions
-            try:
-                bm25 = BM25Retriever.from_documents(parent_docs)
-            except Exception:
-                bm25 = BM25Retriever.from_texts(
-                    [d.page_content for d in parent_docs],
-                    metadatas=[getattr(d, "metadata", {}) for d in parent_docs],
-                )
-            bm25.k = 16 #changed from 12 to 24
-            self.hybrid = EnsembleRetriever(retrievers=[bm25, self.dense_retriever], weights=[0.3, 0.7])
+        self.timings["retriever_build_s"] = time.perf_counter() - t0
+        print(f"Finished hydra — parents={len(parent_ids)}")
+
+    def _make_hybrid(self) -> None:
+        if self.sparse_index is not None:
+            # Dense + sparse run concurrently, weighted RRF on doc_id, one docstore.mget
+            self.hybrid = FusedRetriever(
+                vectorstore=self.vectorstore,
+                sparse_index=self.sparse_index,
+                docstore=self.store,
+                id_key=self.id_key,
+                child_index=self.child_index,
+                child_window=self.child_window,
+                k_dense=16,
+                k_sparse=16, #changed from 12 to 24
+                dense_weight=0.7,
+                sparse_weight=0.3,
+            )
         else:
             # Nothing indexed → fall back to dense retriever only
             self.hybrid = self.dense_retriever
 
-        self.timings["retriever_build_s"] = time.perf_counter() - t0
-        print(f"Finished hydra — parents={len(parent_docs)}")
-
 
     # ---------------------------- RAG PIPE ---------------------------------
-    def _looks_like_b64(self, s: str) -> bool:
-        if not isinstance(s, str) or len(s) < 40:
-            return False
-        try:
-            base64.b64decode(s, validate=True)
-            return True
-        except binascii.Error:
-            return False
-
     def _to_str(self, obj) -> str:
         if isinstance(obj, str):
             return obj
@@ -257,17 +522,35 @@ class HybridEngine:
         return str(obj)
 
     def _parse_docs(self, docs):
+        # Route by `type` metadata; images are carried as image-store ids, not payloads
         images, texts = [], []
         for d in docs:
-            payload = self._to_str(d)
-            (images if self._looks_like_b64(payload) else texts).append(payload)
-        return {"images": images[:6], "texts": texts}  # cap images in prompt
+            meta = getattr(d, "metadata", None) or {}
+            if meta.get("type") == "image" and meta.get("image_id"):
+                images.append(meta["image_id"])
+                caption = self._to_str(d)
+                if caption:
+                    texts.append(f"[Image, page {meta.get('page')}] {caption}")
+                continue
+            texts.append(self._to_str(d))
+            images.extend(meta.get("image_ids", []))
+        return {"images": list(dict.fromkeys(images))[:6], "texts": texts}  # cap images in prompt
+
+    # "figures" is left out on purpose: in finance questions it usually means numbers
+    _FIGURE_RE = re.compile(r"\b(charts?|graphs?|figure|diagrams?|images?|pictures?|photos?|logos?|plots?|visuals?|infographics?)\b", re.I)
+
+    def _needs_pixels(self, question: str) -> bool:
+        # Pixels are only worth their tokens when the figure itself is asked about (captions or not)
+        return bool(self._FIGURE_RE.search(str(question)))
 
     def _build_prompt_two(self, kwargs) -> ChatPromptTemplate:
         ctx = kwargs["context"]; question = kwargs["question"]
         parts = [{"type": "text", "text": f"Context:{ctx.get('texts', [])[:6]}Question: {question}"}]
-        for b64 in ctx.get("images", [])[:6]:
-            parts.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}})
+        images = ctx.get("images", [])[:6] if self._needs_pixels(question) else []
+        for image_id in images:
+            url = self.image_store.data_url(image_id)  # downscaled, re-encoded, base64 only here
+            if url:
+                parts.append({"type": "image_url", "image_url": {"url": url}})
         messages = [SystemMessage(content=system_finance_prompt), HumanMessage(content=parts)]
         return ChatPromptTemplate.from_messages(messages)
 
@@ -292,11 +575,280 @@ class HybridEngine:
         return buf.read()
 
 
+    def _vector_bytes(self) -> int:
+        if isinstance(self.vectorstore, FlatVectorStore):
+            return self.vectorstore.nbytes()
+        try:
+            n_vectors = self.vectorstore._collection.count()
+            sample = self.vectorstore._collection.get(limit=1, include=["embeddings"])["embeddings"]
+            dim = len(sample[0]) if sample is not None and len(sample) else 0
+            return n_vectors * dim * 4  # float32 in the HNSW index
+        except Exception:
+            return 0
+
+    def vector_report(self, k: int = 16, n_queries: int = 100) -> Dict[str, Any]:
+        """Flat index only: bytes saved by quantization and recall@k vs float32, raw and re-scored."""
+        if not isinstance(self.vectorstore, FlatVectorStore):
+            return {}
+        return self.vectorstore.quality_report(k=k, n_queries=n_queries)
+
+    def memory_report(self) -> Dict[str, int]:
+        """Approximate resident bytes per component (image and cache files on disk excluded)."""
+        report = {f"docstore_{k}": v for k, v in self.store.nbytes().items()}
+        report["child_index"] = self.child_index.nbytes()
+        if self.sparse_index is not None:
+            report["bm25"] = self.sparse_index.nbytes()
+        report["vectors"] = self._vector_bytes()
+        report["image_store_index"] = sys.getsizeof(self.image_store._meta) + sys.getsizeof(self.image_store._prepared)
+        report["pending_elements"] = sum(sys.getsizeof(self._el_text(el)) for el in (*self.texts, *self.tables, *self.images))
+        report["pending_files"] = sum(len(read_bytes(f)) for f, _ in self._pending)
+        report["total"] = sum(report.values())
+        report["image_store_disk"] = self.image_store.nbytes()  # on disk, not in `total`
+        if isinstance(self.store, DiskDocStore):
+            report["docstore_disk"] = self.store.disk_bytes()
+        return report
+
+    # ------------------------------ snapshots -----------------------------
+    def save(self, path: str) -> None:
+        """Write a snapshot of the built engine to the directory `path` (see `load`)."""
+        if not self._built:
+            raise RuntimeError("the engine must be built (main / iter_build) before it is saved")
+        t0 = time.perf_counter()
+        os.makedirs(path, exist_ok=True)
+
+        parents = self.store
+        if not isinstance(parents, RecordStore):  # disk docstore: pack the parents into columns
+            parents = RecordStore()
+            keys = list(self.store.yield_keys())
+            for i in range(0, len(keys), 1000):
+                batch = keys[i:i + 1000]
+                parents.mset([(k, d) for k, d in zip(batch, self.store.mget(batch)) if d is not None])
+        parent_arrays, parent_meta = parents.to_arrays()
+        save_arrays(path, "parents", parent_arrays)
+        save_arrays(path, "children", self.child_index.to_arrays())
+
+        # Child vectors in ordinal order, so row n is child n
+        if isinstance(self.vectorstore, FlatVectorStore):
+            ids, vectors = self.vectorstore.vectors()
+        else:
+            got = self.vectorstore._collection.get(include=["embeddings"])
+            ids, vectors = got["ids"], got["embeddings"]
+        if len(ids):
+            order = np.argsort(np.asarray(ids, dtype=np.int64))
+            vectors = np.asarray(vectors, dtype=np.float32)[order]
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        save_arrays(path, "vectors", {"dense": vectors})
+        if self.sparse_index is not None:
+            save_arrays(path, "bm25", self.sparse_index.to_arrays())
+
+        write_manifest(path, {
+            "created": time.time(),
+            "partition": cache_params(self.text_layer),
+            "embedding_model": getattr(self.embeddings, "model", None),
+            "dim": int(vectors.shape[1]) if vectors.size else 0,
+            "child_window": self.child_window,
+            "files": self.file_names,
+            "file_hashes": self._file_hashes,
+            "parents": parent_meta,
+            "images": self.image_store.save(os.path.join(path, "images")),
+            "image_triage": {
+                "hashes": self.image_triage._hashes,
+                "refs": self.image_triage.refs,
+                "digests": self.image_triage._digests,
+                "sizes": self.image_triage._sizes,
+                "pages": {k: sorted(v, key=str) for k, v in self.image_triage._pages.items()},
+            },
+            "progress": {k: self.progress[k] for k in ("pages_indexed", "pages_total")},
+        })
+        self.timings["save_s"] = time.perf_counter() - t0
+        print(f"Finished save — {path}")
+
+    @classmethod
+    def load(cls, path: str, **kwargs: Any) -> "HybridEngine":
+        """Rebuild an engine from `save(path)`; `kwargs` go to `__init__` (e.g. `docstore`).
+
+        Parents, BM25 matrices and vectors are memory-mapped, not parsed. Refuses snapshots of
+        another format or embedding model; a different partition setup only affects files
+        added afterwards and is reported.
+        """
+        t0 = time.perf_counter()
+        manifest = read_manifest(path)
+        engine = cls(**kwargs)
+        model = getattr(engine.embeddings, "model", None)
+        if manifest["embedding_model"] != model:
+            raise ValueError(f"snapshot vectors come from {manifest['embedding_model']!r}, this engine embeds with {model!r}")
+        if manifest["partition"] != json.loads(json.dumps(cache_params(engine.text_layer))):
+            print("[WARN] snapshot was partitioned with other parameters; only newly added files use the current ones")
+
+        parents = RecordStore.from_arrays(load_arrays(path, "parents"), manifest["parents"])
+        if isinstance(engine.store, RecordStore):
+            engine.store = parents
+            engine.dense_retriever.docstore = parents
+        else:
+            keys = list(parents.yield_keys())
+            for i in range(0, len(keys), 1000):
+                batch = keys[i:i + 1000]
+                engine.store.mset(list(zip(batch, parents.mget(batch))))
+
+        engine.child_index = ChildIndex.from_arrays(load_arrays(path, "children"))
+        engine.child_window = manifest["child_window"]
+        vectors = load_arrays(path, "vectors")["dense"]
+        if len(vectors):
+            ids = [str(c) for c in range(len(vectors))]
+            if isinstance(engine.vectorstore, FlatVectorStore):  # zero-copy: search the mapped matrix
+                flat = engine.vectorstore
+                engine.vectorstore = FlatVectorStore.from_arrays(
+                    engine.embeddings, ids, vectors, [{"child": c} for c in range(len(ids))],
+                    dtype=flat.dtype, rescore=flat.rescore, rescore_factor=flat.rescore_factor,
+                )
+                flat.close()
+                engine.dense_retriever.vectorstore = engine.vectorstore
+            else:
+                add_precomputed(engine.vectorstore, ids, [Document(page_content="", metadata={"child": c}) for c in range(len(ids))], vectors, store_text=False)
+        bm25 = load_arrays(path, "bm25")
+        engine.sparse_index = SparseBM25Index.from_arrays(bm25) if bm25 else None
+
+        engine.image_store.adopt(os.path.join(path, "images"), manifest["images"])
+        engine.image_triage._hashes = [tuple(h) for h in manifest["image_triage"]["hashes"]]
+        engine.image_triage.refs = {k: [tuple(r) for r in v] for k, v in manifest["image_triage"]["refs"].items()}
+        engine.image_triage._digests = dict(manifest["image_triage"].get("digests", {}))
+        engine.image_triage._sizes = {k: tuple(v) for k, v in manifest["image_triage"].get("sizes", {}).items()}
+        engine.image_triage._pages = {k: {tuple(r) for r in v} for k, v in manifest["image_triage"].get("pages", {}).items()}
+
+        engine.file_names = list(manifest["files"])
+        engine._file_hashes = list(manifest.get("file_hashes", []))  # absent in older snapshots
+        engine.corpus_id = corpus_id(engine._file_hashes)
+        engine._name_collection()
+        engine._make_hybrid()
+        engine._built = True
+        engine.progress.update(manifest["progress"], done=True)
+        engine.timings["load_s"] = time.perf_counter() - t0
+        print(f"Finished load — {path} parents={len(engine.store)} children={len(engine.child_index)}")
+        return engine
+
+    def touch(self) -> None:
+        """Mark the engine as in use, resetting the sweeper's idle clock."""
+        self.last_used = time.monotonic()
+
+    @contextmanager
+    def in_use(self) -> Iterator[bool]:
+        """Pin the engine for one query or build step; yields False once it is closing.
+
+        `close()` called meanwhile (pool eviction, sweeper) is deferred until the last
+        holder leaves, so a query never sees a closed docstore.
+        """
+        with self._use_lock:
+            ok = not self.closing
+            self._users += int(ok)
+        try:
+            yield ok
+        finally:
+            if ok:
+                with self._use_lock:
+                    self._users -= 1
+                    last = self.closing and self._users == 0
+                if last:
+                    self._release_resources()
+
+    def close(self) -> None:
+        """Drop the vector collection and release the docstore and image files. Idempotent.
+
+        Deferred while the engine is `in_use`; `closing` is set right away.
+        """
+        with self._use_lock:
+            if self.closing:
+                return
+            self.closing = True
+            busy = self._users > 0
+        SWEEPER.unregister(self)
+        if not busy:
+            self._release_resources()
+
+    def _release_resources(self) -> None:
+        self.closed = True
+        if isinstance(self.vectorstore, FlatVectorStore):
+            self.vectorstore.close()
+        self._finalizer()
+        if isinstance(self.store, DiskDocStore):
+            self.store.close()
+        self.image_store.close()
+        self.hybrid = None
+        print(f"Finished close — {self.collection_name}")
+
+    def __enter__(self) -> "HybridEngine":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
     def main(self) -> None:
         if self._built:
             return
-        self._unstructured()
-        self._store_load()
-        self._hydra()
+        self._ingest()
         self._built = True
-        print("Finished pipeline")
\ No newline at end of file
+        print("Finished pipeline")
+
+    # ------------------------- streaming build ----------------------------
+    def iter_build(self, batch_pages: int = 10) -> Iterator[Dict[str, Any]]:
+        """Build page batch by page batch, yielding `self.progress` after each one is indexed.
+
+        The retriever exists after the first batch (`self.hybrid`); later batches are appended
+        to Chroma, the docstore and the sparse index, so answers improve as the rest arrives.
+        """
+        if self._built:
+            return
+        t0 = time.perf_counter()
+        files = [(read_bytes(f_like), fname) for f_like, fname in self._pending]
+        self._pending = []
+        self.progress.update(pages_indexed=0, pages_total=sum(page_count(d) for d, _ in files), done=False, error=None)
+
+        for fname, chunks, pages, secs, from_cache in iter_partition(
+            files,
+            workers=self.workers,
+            batch_pages=batch_pages,
+            cache=self.partition_cache,
+            text_layer=self.text_layer,
+            stats=self.timings,
+        ):
+            with self.in_use() as ok:
+                if not ok:  # closed mid-build: stop before touching the stores
+                    print("Stopped streaming build — engine closed")
+                    return
+                self._absorb(fname, chunks, secs, from_cache)
+                self._dedup()
+                self._store_load()
+                self._hydra()
+                self._release()
+            self.progress["pages_indexed"] += pages
+            if "first_batch_s" not in self.timings:
+                self.timings["first_batch_s"] = time.perf_counter() - t0
+            yield dict(self.progress)
+
+        self._built = True
+        if self._pending:  # files added while streaming
+            self._ingest()
+        self.timings["stream_build_s"] = time.perf_counter() - t0
+        self.progress["done"] = True
+        print("Finished pipeline (streaming)")
+        yield dict(self.progress)
+
+    def start_streaming(self, batch_pages: int = 10) -> threading.Thread:
+        """Run `iter_build` in a daemon thread; poll `self.progress` / `self.hybrid` meanwhile."""
+        def run() -> None:
+            try:
+                for _ in self.iter_build(batch_pages):
+                    pass
+            except Exception as e:
+                self.progress["error"] = repr(e)
+                self.progress["done"] = True
+                print(f"[ERROR] streaming build failed: {e}")
+            for callback in list(self.on_stream_done):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"[WARN] stream-done callback failed: {e}")
+
+        self._stream_thread = threading.Thread(target=run, name="hybrid-engine-stream", daemon=True)
+        self._stream_thread.start()
+        return self._stream_thread
\ No newline at end of file
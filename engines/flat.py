@@ -0,0 +1,379 @@
+import os
+import uuid
+import threading
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from engines.caches import default_cache_root
+
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+_BLOCK = 8192  # rows upcast to float32 at a time when scoring a quantized matrix
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first (argpartition, then sort only those k)."""
+    if k <= 0 or scores.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if scores.size > k:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(scores.size)
+    return idx[np.argsort(-scores[idx])]
+
+
+def quantize(mat: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """(codes, per-row scale): int8 uses symmetric scalar quantisation, scale = max|x| / 127."""
+    if dtype == "int8":
+        scale = np.maximum(np.abs(mat).max(axis=1), 1e-12) / 127.0
+        codes = np.rint(mat / scale[:, None]).astype(np.int8)
+        return codes, scale.astype(np.float32)
+    return mat.astype(DTYPES[dtype], copy=False), None
+
+
+class FlatVectorStore(VectorStore):
+    """Exact cosine search over one contiguous matrix of L2-normalised rows.
+
+    A query is a single matrix-vector product plus `argpartition`; `search_batch` scores many
+    queries with one matrix-matrix product. Rows are appended into a buffer that doubles when
+    full, deletions are masked. For session-sized corpora (up to ~10^5 chunks) this beats an
+    HNSW index on both build and query time and is never approximate.
+
+    `dtype` "float16" (2 bytes/dim) or "int8" (1 byte/dim plus a float32 scale per row) stores
+    the matrix quantized; scoring upcasts it block by block. With `rescore=True` a float32 copy
+    is appended to a file under the cache root, and the top `k * rescore_factor` quantized
+    candidates are re-scored from it (memory-mapped, so only touched pages become resident).
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        dim: Optional[int] = None,
+        dtype: str = "float32",
+        rescore: bool = False,
+        rescore_factor: int = 4,
+    ) -> None:
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {sorted(DTYPES)}, got {dtype!r}")
+        self.embedding = embedding
+        self.dtype = dtype
+        self.rescore = rescore and dtype != "float32"
+        self.rescore_factor = rescore_factor
+        self._mat = np.zeros((0, dim or 0), dtype=DTYPES[dtype])
+        self._scale: Optional[np.ndarray] = np.zeros(0, dtype=np.float32) if dtype == "int8" else None
+        self._n = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self.ids: List[str] = []
+        self._row: Dict[str, int] = {}
+        self._meta: List[Dict[str, Any]] = []
+        self._texts: List[str] = []
+        self._lock = threading.Lock()
+
+        # Full-precision copy for re-scoring: an adopted (mapped) matrix for the first rows,
+        # then an append-only file for every row added after it
+        self._base: Optional[np.ndarray] = None
+        self._full: Optional[np.ndarray] = None
+        self._full_path: Optional[str] = None
+        self._full_rows = 0
+        if self.rescore:
+            root = os.path.join(default_cache_root(), "vectors")
+            os.makedirs(root, exist_ok=True)
+            self._full_path = os.path.join(root, f"{uuid.uuid4().hex}.f32")
+            open(self._full_path, "wb").close()
+            self._finalizer = weakref.finalize(self, _remove, self._full_path)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    # ------------------------------ updates --------------------------------
+    @staticmethod
+    def _normalize(vectors: Any) -> np.ndarray:
+        mat = np.asarray(vectors, dtype=np.float32)
+        if mat.ndim == 1:
+            mat = mat[None, :]
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        return mat / np.maximum(norms, 1e-12)
+
+    def _reserve(self, n_new: int, dim: int) -> None:
+        need = self._n + n_new
+        if self._mat.shape[1] != dim and self._n == 0:
+            self._mat = np.zeros((0, dim), dtype=self._mat.dtype)
+        if self._mat.shape[1] != dim:
+            raise ValueError(f"vector dimension {dim} does not match the index ({self._mat.shape[1]})")
+        if need > self._mat.shape[0] or not self._mat.flags.writeable:
+            cap = max(need, 2 * self._mat.shape[0], 1024)
+            grown = np.empty((cap, dim), dtype=self._mat.dtype)
+            grown[: self._n] = self._mat[: self._n]
+            self._mat = grown
+            alive = np.zeros(cap, dtype=bool)
+            alive[: self._n] = self._alive[: self._n]
+            self._alive = alive
+            if self._scale is not None:
+                scale = np.zeros(cap, dtype=np.float32)
+                scale[: self._n] = self._scale[: self._n]
+                self._scale = scale
+
+    def add_vectors(
+        self,
+        ids: Sequence[str],
+        vectors: Any,
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        texts: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """Upsert precomputed vectors; re-adding an id replaces it."""
+        mat = self._normalize(vectors)
+        if not len(ids):
+            return []
+        codes, scale = quantize(mat, self.dtype)
+        with self._lock:
+            self.delete([i for i in ids if i in self._row], _locked=True)
+            self._reserve(len(ids), mat.shape[1])
+            start = self._n
+            self._mat[start:start + len(ids)] = codes
+            if scale is not None:
+                self._scale[start:start + len(ids)] = scale
+            self._alive[start:start + len(ids)] = True
+            for offset, doc_id in enumerate(ids):
+                self._row[doc_id] = start + offset
+            self.ids.extend(ids)
+            self._meta.extend(dict(m) for m in (metadatas or [{}] * len(ids)))
+            self._texts.extend(texts or [""] * len(ids))
+            if self._full_path is not None:
+                with open(self._full_path, "ab") as fh:
+                    fh.write(mat.tobytes())
+            self._n += len(ids)
+        return list(ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(self._n + i) for i in range(len(texts))]
+        return self.add_vectors(ids, self.embedding.embed_documents(texts), metadatas, texts)
+
+    def delete(self, ids: Optional[List[str]] = None, _locked: bool = False, **kwargs: Any) -> Optional[bool]:
+        if _locked:
+            for doc_id in ids or []:
+                row = self._row.pop(doc_id, None)
+                if row is not None:
+                    self._alive[row] = False
+            return True
+        with self._lock:
+            return self.delete(ids, _locked=True)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "FlatVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_arrays(
+        cls,
+        embedding: Embeddings,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        dtype: str = "float32",
+        rescore: bool = False,
+        rescore_factor: int = 4,
+    ) -> "FlatVectorStore":
+        """Adopt a (possibly memory-mapped) float32 matrix.
+
+        float32: used without copying if its rows are unit length. Quantized: the codes are
+        built in memory and the given matrix itself becomes the re-scoring copy of its rows;
+        rows added later go to the usual append file.
+        """
+        store = cls(embedding, dtype=dtype, rescore=rescore, rescore_factor=rescore_factor)
+        sample = np.asarray(vectors[: min(len(vectors), 256)], dtype=np.float32)
+        unit = vectors.dtype == np.float32 and np.allclose(np.linalg.norm(sample, axis=1), 1.0, atol=1e-3)
+        full = vectors if unit else store._normalize(vectors)
+        if dtype == "float32":
+            store._mat = full
+        else:
+            store._mat = np.empty(full.shape, dtype=DTYPES[dtype])
+            if dtype == "int8":
+                store._scale = np.empty(len(full), dtype=np.float32)
+            for s in range(0, len(full), _BLOCK):
+                codes, scale = quantize(np.asarray(full[s:s + _BLOCK], dtype=np.float32), dtype)
+                store._mat[s:s + _BLOCK] = codes
+                if scale is not None:
+                    store._scale[s:s + _BLOCK] = scale
+            if store.rescore:
+                store._base = full
+        store._n = len(ids)
+        store._alive = np.ones(len(ids), dtype=bool)
+        store.ids = list(ids)
+        store._row = {doc_id: r for r, doc_id in enumerate(store.ids)}
+        store._meta = [dict(m) for m in metadatas] if metadatas is not None else [{} for _ in ids]
+        store._texts = [""] * len(ids)
+        return store
+
+    # ------------------------------- query ---------------------------------
+    def _view(self) -> Tuple[np.ndarray, Optional[np.ndarray], np.ndarray]:
+        with self._lock:
+            n = self._n
+            scale = self._scale[:n] if self._scale is not None else None
+            return self._mat[:n], scale, self._alive[:n]
+
+    @staticmethod
+    def _scores(mat: np.ndarray, scale: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+        """(queries x rows) cosine scores; quantized rows are upcast a block at a time."""
+        if mat.dtype == np.float32:
+            return queries @ mat.T
+        out = np.empty((len(queries), len(mat)), dtype=np.float32)
+        for s in range(0, len(mat), _BLOCK):
+            out[:, s:s + _BLOCK] = queries @ mat[s:s + _BLOCK].astype(np.float32).T
+        if scale is not None:
+            out *= scale
+        return out
+
+    def _appended(self, n: int) -> np.ndarray:
+        """The first `n` rows of the append-only file, remapping it as it grows."""
+        if self._full is None or self._full_rows < n:
+            dim = self._mat.shape[1]
+            rows = os.path.getsize(self._full_path) // (4 * dim)
+            self._full = np.memmap(self._full_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            self._full_rows = rows
+        return self._full
+
+    def _full_take(self, rows: np.ndarray) -> np.ndarray:
+        """Float32 copies of the given rows: adopted ones from `_base`, later ones from the file."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self._mat.shape[1]), dtype=np.float32)
+        nb = len(self._base) if self._base is not None else 0
+        head = rows < nb
+        if head.any():
+            out[head] = self._base[rows[head]]
+        if not head.all():
+            tail = rows[~head] - nb
+            out[~head] = self._appended(int(tail.max()) + 1)[tail]
+        return out
+
+    def _rank(self, q: np.ndarray, scores: np.ndarray, alive: np.ndarray, k: int, rescore: bool) -> List[Tuple[int, float]]:
+        scores[~alive] = -np.inf
+        k = min(k, int(alive.sum()))
+        if not (rescore and self.rescore):
+            return [(int(r), float(scores[r])) for r in top_k(scores, k)]
+        cand = top_k(scores, min(int(alive.sum()), k * self.rescore_factor))
+        cand = np.sort(cand)
+        exact = self._full_take(cand) @ q
+        best = top_k(exact, k)
+        return [(int(cand[i]), float(exact[i])) for i in best]
+
+    def search_vectors(self, query: Any, k: int = 4, rescore: bool = True) -> List[Tuple[int, float]]:
+        mat, scale, alive = self._view()
+        if not len(mat):
+            return []
+        q = self._normalize(query)
+        return self._rank(q[0], self._scores(mat, scale, q)[0], alive.copy(), k, rescore)
+
+    def search_batch(self, queries: Any, k: int = 4, rescore: bool = True) -> List[List[Tuple[int, float]]]:
+        """Top-k rows for many query vectors with one matrix-matrix product."""
+        mat, scale, alive = self._view()
+        if not len(mat):
+            return [[] for _ in range(len(queries))]
+        q = self._normalize(queries)
+        scores = self._scores(mat, scale, q)
+        return [self._rank(q[i], scores[i], alive.copy(), k, rescore) for i in range(len(q))]
+
+    def _docs(self, hits: List[Tuple[int, float]]) -> List[Tuple[Document, float]]:
+        return [
+            (Document(page_content=self._texts[r], metadata=dict(self._meta[r])), score)
+            for r, score in hits
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [d for d, _ in self._docs(self.search_vectors(embedding, k))]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self._docs(self.search_vectors(self.embedding.embed_query(query), k))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return lambda score: score  # already cosine similarity
+
+    # ------------------------------- quality -------------------------------
+    def quality_report(self, k: int = 16, n_queries: int = 100, seed: int = 0) -> Dict[str, Any]:
+        """Memory saved by quantisation and recall@k against float32, with and without re-scoring.
+
+        Queries are stored vectors (sampled); ground truth is exact search over the float32
+        copy, so this needs `rescore=True` unless the store is float32 already.
+        """
+        mat, scale, alive = self._view()
+        n, dim = mat.shape
+        report: Dict[str, Any] = {
+            "dtype": self.dtype,
+            "vectors": int(alive.sum()),
+            "bytes": int(mat.nbytes + (scale.nbytes if scale is not None else 0)),
+            "bytes_float32": int(n * dim * 4),
+        }
+        report["saved_bytes"] = report["bytes_float32"] - report["bytes"]
+        if not n or not (self.dtype == "float32" or self.rescore):
+            return report
+        full = mat if self.dtype == "float32" else self._full_take(np.arange(n))
+        rows = np.flatnonzero(alive)
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(rows, size=min(n_queries, len(rows)), replace=False)
+        queries = np.asarray(full[sample], dtype=np.float32)
+        truth = [set(top_k(np.where(alive, s, -np.inf), k).tolist()) for s in self._scores(full, None, queries)]
+        for label, rescore in (("recall_quantized", False), ("recall_rescored", True)):
+            hits = self.search_batch(queries, k, rescore=rescore)
+            report[f"{label}@{k}"] = float(np.mean([len({r for r, _ in h} & t) / max(len(t), 1) for h, t in zip(hits, truth)]))
+        return report
+
+    # ------------------------------ snapshot -------------------------------
+    def vectors(self) -> Tuple[List[str], np.ndarray]:
+        """Live (ids, float32 rows) in insertion order; quantized rows come from the float32 copy or are decoded."""
+        mat, scale, alive = self._view()
+        rows = np.flatnonzero(alive)
+        if self.dtype == "float32":
+            out = mat[rows]
+        elif self.rescore:
+            out = self._full_take(rows)
+        else:
+            out = mat[rows].astype(np.float32) * (scale[rows, None] if scale is not None else 1.0)
+        return [self.ids[r] for r in rows], out
+
+    def nbytes(self) -> int:
+        """Resident bytes of the search matrix (the float32 re-scoring copy is on disk)."""
+        total = self._mat.nbytes + self._alive.nbytes
+        if self._scale is not None:
+            total += self._scale.nbytes
+        return int(total)
+
+    def close(self) -> None:
+        self._base = self._full = None
+        if self._full_path is not None:
+            self._finalizer()
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
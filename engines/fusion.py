@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from engines.hierarchy import sentence_windows
+
+
+# Shared by all engines in the process; each query needs two short-lived tasks.
+_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fused-retriever")
+
+
+def rrf_fuse(rankings: List[List[str]], weights: List[float], c: int = 60) -> List[str]:
+    """Weighted reciprocal-rank fusion of several ranked id lists."""
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (c + rank + 1)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+class FusedRetriever(BaseRetriever):
+    """Dense + sparse retrieval run concurrently, fused by weighted RRF on `doc_id`.
+
+    The dense branch searches the child vectors and maps hits to their parent ids (through
+    `child_index` when children carry a `child` ordinal, else their `id_key`), the sparse
+    branch asks the BM25 index for parent ids directly; the fused id list is resolved with a
+    single `docstore.mget`, so parents are fetched once and never duplicated. Text parents
+    hit through a child come back with the matched sentence window in `metadata["match"]`,
+    so consumers can show the part of a large parent that actually matched.
+    """
+
+    vectorstore: Any
+    sparse_index: Any = None
+    docstore: Any
+    id_key: str = "doc_id"
+    child_index: Any = None
+    child_window: int = 3
+    k_dense: int = 16
+    k_sparse: int = 16
+    dense_weight: float = 0.7
+    sparse_weight: float = 0.3
+    c: int = 60
+    top_n: Optional[int] = None
+    last_timings: Dict[str, float] = {}
+
+    def _dense_ids(self, query: str) -> Tuple[List[str], Dict[str, int]]:
+        """Parent ids in rank order, and the rank of each parent's matched child."""
+        t0 = time.perf_counter()
+        children = self.vectorstore.similarity_search(query, k=self.k_dense)
+        ranks: Dict[str, int] = {}
+        if self.child_index is not None:
+            ranks = dict(self.child_index.hits(d.metadata["child"] for d in children if "child" in (d.metadata or {})))
+            ids = list(ranks)
+        else:
+            ids = list(dict.fromkeys(
+                d.metadata[self.id_key] for d in children if self.id_key in (d.metadata or {})
+            ))
+        self.last_timings["dense_s"] = time.perf_counter() - t0
+        return ids, ranks
+
+    def _with_match(self, doc: Document, rank: Optional[int]) -> Document:
+        if rank is None or (doc.metadata or {}).get("type") != "text":
+            return doc
+        windows = sentence_windows(doc.page_content, self.child_window)
+        if not 0 <= rank < len(windows):
+            return doc
+        return Document(page_content=doc.page_content, metadata={**doc.metadata, "match": windows[rank]})
+
+    def _sparse_ids(self, query: str) -> List[str]:
+        t0 = time.perf_counter()
+        ids = [doc_id for doc_id, _ in self.sparse_index.search(query, self.k_sparse)] if self.sparse_index is not None else []
+        self.last_timings["sparse_s"] = time.perf_counter() - t0
+        return ids
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        t0 = time.perf_counter()
+        dense_f = _POOL.submit(self._dense_ids, query)
+        sparse_f = _POOL.submit(self._sparse_ids, query)
+        dense_ids, ranks = dense_f.result()
+        fused = rrf_fuse([dense_ids, sparse_f.result()], [self.dense_weight, self.sparse_weight], self.c)
+        if self.top_n is not None:
+            fused = fused[: self.top_n]
+        docs = self.docstore.mget(fused) if fused else []
+        self.last_timings["total_s"] = time.perf_counter() - t0
+        return [self._with_match(d, ranks.get(doc_id)) for doc_id, d in zip(fused, docs) if d is not None]
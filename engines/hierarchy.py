@@ -0,0 +1,112 @@
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+# Sentence ends followed by what looks like a new sentence, or a line break
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+(?=[A-Z0-9\"'“(\[•\-])|\s*\n+\s*")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in (p.strip() for p in _SENTENCE_RE.split(text or "")) if s]
+
+
+def sentence_windows(text: str, size: int = 3, overlap: int = 1) -> List[str]:
+    """Windows of `size` consecutive sentences, consecutive windows sharing `overlap` of them."""
+    sentences = split_sentences(text)
+    if len(sentences) <= size:
+        return [" ".join(sentences)] if sentences else []
+    stride = max(1, size - overlap)
+    windows = []
+    for start in range(0, len(sentences), stride):
+        windows.append(" ".join(sentences[start:start + size]))
+        if start + size >= len(sentences):
+            break
+    return windows
+
+
+def focus(text: str, match: Optional[str] = None, max_chars: int = 1500) -> str:
+    """Up to `max_chars` of `text` (whitespace collapsed) centred on `match`, else its head."""
+    flat = " ".join((text or "").split())
+    if len(flat) <= max_chars:
+        return flat
+    at = flat.find(" ".join(match.split())) if match else -1
+    if at < 0:
+        return flat[:max_chars]
+    start = max(0, min(at - max(0, max_chars - len(match)) // 2, len(flat) - max_chars))  # a long match keeps its head
+    return ("…" if start else "") + flat[start:start + max_chars] + ("…" if start + max_chars < len(flat) else "")
+
+
+class ChildIndex:
+    """Child ordinal -> parent ordinal in an int32 array; parent ordinals resolve to docstore ids.
+
+    Children are stored in the vector store under their ordinal, with only `{"child": n}` as
+    metadata, so no parent id string is repeated per child.
+    """
+
+    def __init__(self) -> None:
+        self._parent = array("i")
+        self._first = array("i")  # parent ordinal -> its first child ordinal
+        self.parent_ids: List[str] = []
+        self._ordinal: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._parent)
+
+    def add(self, parent_id: str, n_children: int) -> range:
+        """Register `n_children` new children of `parent_id`; returns their ordinals."""
+        with self._lock:
+            p = self._ordinal.get(parent_id)
+            if p is None:
+                p = self._ordinal[parent_id] = len(self.parent_ids)
+                self.parent_ids.append(parent_id)
+                self._first.append(len(self._parent))
+            start = len(self._parent)
+            self._parent.extend([p] * n_children)
+        return range(start, start + n_children)
+
+    def parents(self, children: Iterable[int]) -> List[str]:
+        """Parent ids of the given children, deduplicated, in first-hit order."""
+        seen: Dict[int, None] = {}
+        n = len(self._parent)
+        for c in children:
+            if 0 <= c < n:
+                seen.setdefault(self._parent[c], None)
+        return [self.parent_ids[p] for p in seen]
+
+    def hits(self, children: Iterable[int]) -> List[Tuple[str, int]]:
+        """(parent id, rank of the best-matching child within that parent), deduplicated by parent.
+
+        A text parent's children are its `sentence_windows` in order, so the rank recovers the
+        matched window from the parent text without storing child text anywhere.
+        """
+        seen: Dict[int, int] = {}
+        n = len(self._parent)
+        for c in children:
+            if 0 <= c < n:
+                p = self._parent[c]
+                seen.setdefault(p, c - self._first[p])
+        return [(self.parent_ids[p], rank) for p, rank in seen.items()]
+
+    def nbytes(self) -> int:
+        return self._parent.itemsize * len(self._parent) + self._first.itemsize * len(self._first)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            return {"parent": np.frombuffer(self._parent, dtype=np.int32).copy(), "parent_ids": np.array(self.parent_ids, dtype=str)}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "ChildIndex":
+        index = cls()
+        index._parent = array("i", np.asarray(arrays["parent"], dtype=np.int32).tobytes())
+        index.parent_ids = arrays["parent_ids"].tolist()
+        first = np.full(len(index.parent_ids), -1, dtype=np.int32)
+        ordinals, at = np.unique(np.asarray(arrays["parent"]), return_index=True)
+        first[ordinals] = at
+        index._first = array("i", first.tobytes())
+        index._ordinal = {pid: p for p, pid in enumerate(index.parent_ids)}
+        return index
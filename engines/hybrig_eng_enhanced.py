@@ -1,7 +1,10 @@
 
 import io
 import time
+import asyncio
+import threading
 import uuid
+import weakref
 import base64
 import binascii
 from typing import Any, Iterable, List, Optional, Tuple, Dict
@@ -14,7 +17,6 @@ except Exception:
     pass
 
 from dotenv import  load_dotenv
-from unstructured.partition.pdf import partition_pdf
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
@@ -28,6 +30,10 @@ from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.messages import SystemMessage, HumanMessage
 # import pysqlite3
 from engines.prompts import system_finance_prompt
+from engines.partition import partition_files, read_bytes, split_elements
+from engines.caches import CachedEmbeddings, PartitionCache, SummaryCache, corpus_id, sha256_hex
+from engines.scheduler import AdaptiveScheduler
+from engines.lifecycle import SWEEPER, chroma_client, collection_name, current_session_id, reclaim, rename_collection
 
 load_dotenv()
 
@@ -41,12 +47,42 @@ class HybridEngine:
     - Summarize only *long* chunks; embed short chunks directly (no LLM call).
     - Lower retrieval fanout (k) and cap images included in prompt.
     - Concurrency for LLM summarization.
+    - Multi-file partitioning in a process pool (`workers`).
+    - Page-window sharding of long PDFs across the same pool (`shard_pages`).
+    - On-disk partition cache keyed by PDF hash, so repeat uploads skip OCR (`cache`).
+    - Text-layer pre-pass: digitally born pages without tables, charts or large images skip
+      hi_res OCR (`text_layer`). It runs per page window inside the workers; its cost is
+      `timings["text_layer_prepass_s"]`, already netted out of `text_layer_saved_s`.
+    - SQLite embedding cache keyed by (model, chunk hash), so repeated chunks skip the API.
+    - SQLite summary cache keyed by (model, prompt hash, chunk hash); texts and tables share
+      one async scheduler that adapts concurrency to rate-limit headers and backs off on 429s.
+    - Progressive mode: raw chunks are indexed and the chain is usable right after OCR;
+      summaries are computed in a background thread and upserted under the same ids.
+    - One Chroma collection per engine, `rag-<corpus hash>-<id>`, in a shared client; dropped by
+      `close()` / `with HybridEngine(...)` or the idle sweeper (engines/lifecycle.py).
     - Stage timings exposed in `self.timings`.
     """
 
-    def __init__(self, pdfs: Optional[Iterable[Tuple[io.BytesIO, str]]] = None) -> None:
+    def __init__(
+        self,
+        pdfs: Optional[Iterable[Tuple[io.BytesIO, str]]] = None,
+        workers: int = 1,
+        shard_pages: int = 0,
+        cache: bool = True,
+        text_layer: bool = True,
+        progressive: bool = False,
+    ) -> None:
         # Inputs
         self._files: List[Tuple[io.BytesIO, str]] = []
+        self._file_hashes: List[str] = []  # sha256 per added file; `corpus_id` derives from them
+        self.corpus_id = corpus_id([])
+        for f_like, name in pdfs or []:
+            self._queue(f_like, name)
+        self.workers = max(1, int(workers))  # >1 partitions files in a process pool
+        self.shard_pages = max(0, int(shard_pages))  # >0 splits long PDFs into page windows
+        self.partition_cache: Optional[PartitionCache] = PartitionCache() if cache else None
+        self.text_layer = text_layer  # skip OCR on plain-text pages with an embedded text layer
+        self.progressive = progressive  # index raw chunks first, summarize in the background
         self._built: bool = False
         self.timings: Dict[str, float] = {}
 
@@ -60,11 +96,22 @@ class HybridEngine:
         self.image_sources: List[str] = []
 
         # Summaries
+        self.summary_model = "gpt-4o"
+        self.summary_cache: Optional[SummaryCache] = SummaryCache() if cache else None
         self.text_summaries: List[str] = []
         self.table_summaries: List[str] = []
+        self.summaries_ready = threading.Event()
+        self._summary_thread: Optional[threading.Thread] = None
+        self._text_ids: List[str] = []
+        self._table_ids: List[str] = []
 
         # Vector & store
-        self.vectorstore = Chroma(collection_name="multi_modal_rag", embedding_function=OpenAIEmbeddings())
+        self.embeddings = CachedEmbeddings(OpenAIEmbeddings()) if cache else OpenAIEmbeddings()
+        self._instance = uuid.uuid4().hex[:8]
+        self.collection_name = collection_name(self.corpus_id, self._instance)  # follows `corpus_id`
+        SWEEPER.claim(self.collection_name)
+        self._finalizer = weakref.finalize(self, reclaim, self.collection_name)
+        self.vectorstore = Chroma(client=chroma_client(), collection_name=self.collection_name, embedding_function=self.embeddings)
         self.store = InMemoryStore()
         self.id_key = "doc_id"
         self.dense_retriever = MultiVectorRetriever(
@@ -79,17 +126,57 @@ class HybridEngine:
         self.chain = None
         self.chain_with_sources = None
 
-        if pdfs:
-            for f_like, name in pdfs:
-                self.add_file(f_like, name)
+        # Lifecycle (see `close`): the sweeper closes engines of ended sessions or idle too long
+        self.session_id = current_session_id()
+        self.last_used = time.monotonic()
+        self.closing = self.closed = False
+        SWEEPER.register(self)
+
+    # ------------------------------ lifecycle ------------------------------
+    def touch(self) -> None:
+        """Mark the engine as in use, resetting the sweeper's idle clock."""
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        """Drop the vector collection and the in-memory parents. Idempotent."""
+        if self.closing:
+            return
+        self.closing = self.closed = True
+        SWEEPER.unregister(self)
+        self._finalizer()
+        self.store.mdelete(list(self.store.yield_keys()))
+        self.hybrid = self.chain = self.chain_with_sources = None
+        print(f"Finished close — {self.collection_name}")
+
+    def __enter__(self) -> "HybridEngine":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _name_collection(self) -> None:
+        """Rename the collection (and move the sweeper claim) after `corpus_id` changed."""
+        name = collection_name(self.corpus_id, self._instance)
+        if name == self.collection_name:
+            return
+        rename_collection(self.vectorstore._collection, self.collection_name, name)
+        self._finalizer.detach()
+        self.collection_name = name
+        self._finalizer = weakref.finalize(self, reclaim, name)
 
     # ------------------------------ ingestion ------------------------------
-    def add_file(self, file_like: io.BytesIO, name: str) -> None:
+    def _queue(self, file_like: io.BytesIO, name: str) -> None:
         try:
             file_like.seek(0)
         except Exception:
             pass
         self._files.append((file_like, name))
+        self._file_hashes.append(sha256_hex(read_bytes(file_like)))
+        self.corpus_id = corpus_id(self._file_hashes)
+
+    def add_file(self, file_like: io.BytesIO, name: str) -> None:
+        self._queue(file_like, name)
+        self._name_collection()
 
     def _unstructured(self) -> None:
         t0 = time.perf_counter()
@@ -97,37 +184,31 @@ class HybridEngine:
         tables, texts, images = [], [], []
         t_src, x_src, i_src = [], [], []
 
-        for f_like, fname in self._files:
-            f_like.seek(0)
-            chunks = partition_pdf(
-                file=f_like,
-                infer_table_structure=False,   # big speed win; still keeps text
-                strategy="hi_res",             # OCR for scanned PDFs
-                extract_image_block_types=["Image"],
-                extract_image_block_to_payload=True,
-                chunking_strategy="by_title",
-                max_characters=6000,
-                combine_text_under_n_chars=1500,
-                new_after_n_chars=4000,
-            )
+        files = [(read_bytes(f_like), fname) for f_like, fname in self._files]
+        results = partition_files(
+            files,
+            workers=self.workers,
+            shard_pages=self.shard_pages,
+            cache=self.partition_cache,
+            text_layer=self.text_layer,
+            stats=self.timings,
+        )
+
+        for fname, chunks, secs, from_cache in results:
             all_chunks.extend(chunks)
+            self.timings[f"partition_s[{fname}]"] = secs
+            self.timings["partition_cache_hits"] = self.timings.get("partition_cache_hits", 0) + int(from_cache)
 
-            for chunk in chunks:
-                if hasattr(chunk, "metadata") and getattr(chunk.metadata, "orig_elements", None):
-                    for el in chunk.metadata.orig_elements:
-                        t = str(type(el))
-                        if "Table" in t:
-                            tables.append(el); t_src.append(fname)
-                        elif "Image" in t:
-                            images.append(el); i_src.append(fname)
-                        else:
-                            texts.append(el); x_src.append(fname)
+            f_tables, f_texts, f_images = split_elements(chunks)
+            tables.extend(f_tables); t_src.extend([fname] * len(f_tables))
+            texts.extend(f_texts); x_src.extend([fname] * len(f_texts))
+            images.extend(f_images); i_src.extend([fname] * len(f_images))
 
         self.chunks = all_chunks
         self.tables, self.texts, self.images = tables, texts, images
         self.table_sources, self.text_sources, self.image_sources = t_src, x_src, i_src
         self.timings["unstructured_s"] = time.perf_counter() - t0
-        print(f"Finished unstructured — texts={len(texts)} tables={len(tables)} images={len(images)}")
+        print(f"Finished unstructured — files={len(results)} workers={self.workers} texts={len(texts)} tables={len(tables)} images={len(images)}")
 
     def _el_text(self, el: Any) -> str:
         return getattr(el, "text", str(el)) or ""
@@ -140,57 +221,81 @@ class HybridEngine:
             "Element: {element}"
         )
         prompt = ChatPromptTemplate.from_template(prompt_text)
-        model = ChatOpenAI(model="gpt-4o", temperature=0.1)
-        summarize_chain = {"element": lambda x: x} | prompt | model | StrOutputParser()
+        # Retries (429s, timeouts, 5xx) are left to the scheduler, which also reads the rate-limit headers
+        model = ChatOpenAI(model=self.summary_model, temperature=0.1, max_retries=0, include_response_headers=True)
+        summarize_chain = {"element": lambda x: x} | prompt | model
 
         # Only summarize long chunks; keep short ones as-is (saves many LLM calls)
         def split_long_short(seq: List[Any], thresh: int = 800):
-            long_items, short_items, long_idx, short_idx = [], [], [], []
+            summaries: List[Optional[str]] = [None] * len(seq)
+            long_items: List[Tuple[int, str]] = []
             for i, el in enumerate(seq):
                 s = self._el_text(el)
                 if len(s) > thresh:
-                    long_items.append(s[:4000])  # truncate for cost
-                    long_idx.append(i)
+                    long_items.append((i, s[:4000]))  # truncate for cost
                 else:
-                    short_items.append(s)
-                    short_idx.append(i)
-            return long_items, short_items, long_idx, short_idx
-
-        # Texts
-        long_t, short_t, long_t_idx, short_t_idx = split_long_short(self.texts)
-        summaries_t = [None] * len(self.texts)
-        if long_t:
-            outs = summarize_chain.batch(long_t, {"max_concurrency": 6})
-            for pos, idx in enumerate(long_t_idx):
-                summaries_t[idx] = outs[pos]
-        for idx, s in zip(short_t_idx, short_t):
-            summaries_t[idx] = s
-        self.text_summaries = summaries_t  # type: ignore
+                    summaries[i] = s
+            return summaries, long_items
+
+        summaries_t, long_t = split_long_short(self.texts)
+        summaries_tb, long_tb = split_long_short(self.tables, thresh=400)
+
+        # Texts and tables share one queue; cached summaries never reach the API
+        todo = [(summaries_t, i, s) for i, s in long_t] + [(summaries_tb, i, s) for i, s in long_tb]
+        prompt_hash = SummaryCache.text_hash(prompt_text)
+        hashes = [SummaryCache.text_hash(s) for _, _, s in todo]
+        cached = self.summary_cache.get_many(self.summary_model, prompt_hash, hashes) if self.summary_cache else {}
+        misses: Dict[str, str] = {}
+        for (out, i, s), h in zip(todo, hashes):
+            if h in cached:
+                out[i] = cached[h]
+            else:
+                misses.setdefault(h, s)
+
+        if misses:
+            async def summarize(text: str):
+                msg = await summarize_chain.ainvoke(text)
+                return msg.content, (msg.response_metadata or {}).get("headers")
+
+            scheduler = AdaptiveScheduler(concurrency=6)
+            outs = asyncio.run(scheduler.run([lambda t=t: summarize(t) for t in misses.values()]))
+            fresh: Dict[str, str] = {}
+            for h, text, res in zip(misses, misses.values(), outs):
+                if isinstance(res, Exception):
+                    print(f"[WARN] summarization failed, indexing raw chunk instead: {res}")
+                    res = text  # not cached, so the next build retries it
+                else:
+                    fresh[h] = res
+                misses[h] = res
+            for (out, i, _), h in zip(todo, hashes):
+                if out[i] is None:
+                    out[i] = misses[h]
+            if self.summary_cache and fresh:
+                self.summary_cache.put_many(self.summary_model, prompt_hash, list(fresh.items()))
+            self.timings["summary_llm_calls"] = scheduler.stats["calls"]
+            self.timings["summary_rate_limited"] = scheduler.stats["rate_limited"]
+            self.timings["summary_transient_errors"] = scheduler.stats["transient_errors"]
+            self.timings["summary_concurrency"] = scheduler.concurrency
+        else:
+            self.timings["summary_llm_calls"] = 0
 
-        # Tables
-        long_tb, short_tb, long_tb_idx, short_tb_idx = split_long_short(self.tables, thresh=400)
-        summaries_tb = [None] * len(self.tables)
-        if long_tb:
-            outs = summarize_chain.batch(long_tb, {"max_concurrency": 6})
-            for pos, idx in enumerate(long_tb_idx):
-                summaries_tb[idx] = outs[pos]
-        for idx, s in zip(short_tb_idx, short_tb):
-            summaries_tb[idx] = s
+        self.text_summaries = summaries_t  # type: ignore
         self.table_summaries = summaries_tb  # type: ignore
-
+        self.timings["summary_cache_hits"] = len(todo) - sum(h in misses for h in hashes)
         self.timings["summarization_s"] = time.perf_counter() - t0
-        print("Finished summarization")
+        print(f"Finished summarization — llm_calls={self.timings['summary_llm_calls']} cache_hits={self.timings['summary_cache_hits']}")
 
     def _store_load(self) -> None:
         t0 = time.perf_counter()
         # Texts → vector + parents
+        # The vector id is the parent doc_id, so a later summary upsert replaces it in place
         text_ids = [str(uuid.uuid4()) for _ in self.texts]
         summary_texts = [
             Document(page_content=self.text_summaries[i] or "", metadata={self.id_key: text_ids[i], "source": self.text_sources[i]})
             for i in range(len(self.texts))
         ]
         if summary_texts:
-            self.dense_retriever.vectorstore.add_documents(summary_texts)
+            self.dense_retriever.vectorstore.add_documents(summary_texts, ids=text_ids)
 
         parent_text_docs = [
             Document(page_content=self._el_text(el), metadata={"source": self.text_sources[i], "type": "text"})
@@ -206,7 +311,7 @@ class HybridEngine:
             for i in range(len(self.tables))
         ]
         if summary_tables:
-            self.dense_retriever.vectorstore.add_documents(summary_tables)
+            self.dense_retriever.vectorstore.add_documents(summary_tables, ids=table_ids)
 
         parent_table_docs = [
             Document(page_content=self._el_text(el), metadata={"source": self.table_sources[i], "type": "table"})
@@ -226,9 +331,50 @@ class HybridEngine:
         if parent_image_docs:
             self.dense_retriever.docstore.mset(list(zip(image_ids, parent_image_docs)))
 
+        self._text_ids, self._table_ids = text_ids, table_ids
+        if isinstance(self.embeddings, CachedEmbeddings):
+            self.timings["embedding_cache_hits"] = self.embeddings.hits
+            self.timings["embedding_cache_misses"] = self.embeddings.misses
         self.timings["store_load_s"] = time.perf_counter() - t0
         print("Finished store load")
 
+    def _raw_summaries(self) -> None:
+        """Progressive mode: embed the chunk text itself until the summaries are in."""
+        self.text_summaries = [self._el_text(el) for el in self.texts]
+        self.table_summaries = [self._el_text(el) for el in self.tables]
+
+    def _upsert_summaries(self) -> None:
+        """Replace the raw-chunk vectors with summary vectors under the same doc_id."""
+        t0 = time.perf_counter()
+        ids: List[str] = []
+        docs: List[Document] = []
+        groups = (
+            (self._text_ids, self.texts, self.text_summaries, self.text_sources),
+            (self._table_ids, self.tables, self.table_summaries, self.table_sources),
+        )
+        for doc_ids, elements, summaries, sources in groups:
+            for i, doc_id in enumerate(doc_ids):
+                summary = summaries[i] or ""
+                if summary == self._el_text(elements[i]):
+                    continue  # short chunk, already indexed as-is
+                ids.append(doc_id)
+                docs.append(Document(page_content=summary, metadata={self.id_key: doc_id, "source": sources[i]}))
+        if ids:
+            self.vectorstore.update_documents(ids, docs)
+        self.timings["summary_upsert_s"] = time.perf_counter() - t0
+        print(f"Finished summary upsert — vectors={len(ids)}")
+
+    def _background_summaries(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            self._summarization()
+            self._upsert_summaries()
+        except Exception as e:
+            print(f"[WARN] background summarization failed, keeping raw-chunk vectors: {e}")
+        finally:
+            self.timings["background_summaries_s"] = time.perf_counter() - t0
+            self.summaries_ready.set()
+
     # def _hydra(self) -> None:
     #     t0 = time.perf_counter()
     #     # Build BM25 over stored parents
@@ -354,10 +500,20 @@ class HybridEngine:
     def main(self) -> None:
         if self._built:
             return
+        t0 = time.perf_counter()
         self._unstructured()
-        self._summarization()
+        if self.progressive:
+            self._raw_summaries()
+        else:
+            self._summarization()
         self._store_load()
         self._hydra()
         self._RAG()
         self._built = True
+        self.timings["time_to_first_question_s"] = time.perf_counter() - t0
+        if self.progressive:
+            self._summary_thread = threading.Thread(target=self._background_summaries, name="summaries", daemon=True)
+            self._summary_thread.start()
+        else:
+            self.summaries_ready.set()
         print("Finished pipeline")
\ No newline at end of file
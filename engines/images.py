@@ -0,0 +1,255 @@
+import io
+import os
+import base64
+import hashlib
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from PIL import Image
+
+from engines.caches import default_cache_root
+
+
+def image_payload(el: Any) -> Optional[Tuple[bytes, str]]:
+    """Raw bytes + MIME type of an unstructured Image element (extract_image_block_to_payload=True)."""
+    md = getattr(el, "metadata", None)
+    b64 = getattr(md, "image_base64", None) or getattr(el, "payload", None) or getattr(el, "data", None)
+    if not b64:
+        return None
+    if isinstance(b64, (bytes, bytearray)):
+        return bytes(b64), getattr(md, "image_mime_type", None) or "image/jpeg"
+    try:
+        data = base64.b64decode(b64)
+    except Exception:
+        return None
+    return data, getattr(md, "image_mime_type", None) or "image/jpeg"
+
+
+def prepare_image(data: bytes, mime: str, max_side: int = 1024, fmt: str = "JPEG", quality: int = 80) -> Tuple[bytes, str]:
+    """Downscale to `max_side` and re-encode as JPEG/WebP for the vision model.
+
+    Falls back to the original when it cannot be decoded, or when it is already within
+    bounds in a lossy format and re-encoding would not make it smaller.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            fits = max(img.size) <= max_side
+            if not fits:
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+            if img.mode not in ("RGB", "L"):
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, "white")
+                img.paste(rgba, mask=rgba.split()[-1])  # flatten transparency onto white
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, quality=quality, optimize=True)
+    except Exception:
+        return data, mime
+    out = buf.getvalue()
+    if fits and mime in ("image/jpeg", "image/webp") and len(out) >= len(data):
+        return data, mime
+    return out, f"image/{fmt.lower()}"
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    if os.path.exists(dst) and os.path.samefile(src, dst):  # re-saving a loaded snapshot in place
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ImageStore:
+    """Binary image store kept out of the text indexes.
+
+    Raw bytes go to one file per image under a private directory; only (path, mime, size)
+    stays in memory. Base64 is produced on demand, when an image is placed in a prompt, from
+    a prepared variant (downscaled to `max_side`, re-encoded as `fmt` at `quality`) that is
+    built once per image id and kept next to the original.
+    The directory is removed when the store is closed or garbage-collected.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_side: int = 1024,
+        fmt: str = "JPEG",
+        quality: int = 80,
+    ) -> None:
+        base = root or os.path.join(default_cache_root(), "images")
+        os.makedirs(base, exist_ok=True)
+        self.root = tempfile.mkdtemp(prefix="store-", dir=base)
+        self.max_side, self.fmt, self.quality = max_side, fmt, quality
+        self._meta: Dict[str, Tuple[str, str, int]] = {}  # id -> (path, mime, bytes)
+        self._prepared: Dict[str, Tuple[str, str, int]] = {}  # id -> prepared (path, mime, bytes)
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.root, True)
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def __contains__(self, image_id: str) -> bool:
+        return image_id in self._meta
+
+    def put(self, image_id: str, data: bytes, mime: str = "image/jpeg") -> None:
+        path = os.path.join(self.root, image_id)
+        with open(path, "wb") as fh:
+            fh.write(data)
+        with self._lock:
+            self._meta[image_id] = (path, mime, len(data))
+
+    def get(self, image_id: str) -> Optional[bytes]:
+        entry = self._meta.get(image_id)
+        if entry is None:
+            return None
+        with open(entry[0], "rb") as fh:
+            return fh.read()
+
+    def mime(self, image_id: str) -> str:
+        entry = self._meta.get(image_id)
+        return entry[1] if entry else "image/jpeg"
+
+    def prepared(self, image_id: str) -> Optional[Tuple[bytes, str]]:
+        """Prompt-ready (bytes, mime) for an image, built on first use and then reused."""
+        entry = self._prepared.get(image_id)
+        if entry is not None:
+            with open(entry[0], "rb") as fh:
+                return fh.read(), entry[1]
+        data = self.get(image_id)
+        if data is None:
+            return None
+        out, mime = prepare_image(data, self.mime(image_id), self.max_side, self.fmt, self.quality)
+        path = os.path.join(self.root, f"{image_id}.prepared")
+        with open(path, "wb") as fh:
+            fh.write(out)
+        with self._lock:
+            self._prepared[image_id] = (path, mime, len(out))
+        return out, mime
+
+    def data_url(self, image_id: str, prepared: bool = True) -> Optional[str]:
+        if prepared:
+            hit = self.prepared(image_id)
+            if hit is None:
+                return None
+            data, mime = hit
+        else:
+            data, mime = self.get(image_id), self.mime(image_id)
+            if data is None:
+                return None
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def delete(self, image_id: str) -> None:
+        with self._lock:
+            entries = [self._meta.pop(image_id, None), self._prepared.pop(image_id, None)]
+        for entry in entries:
+            if entry:
+                try:
+                    os.remove(entry[0])
+                except OSError:
+                    pass
+
+    def keys(self) -> Iterator[str]:
+        return iter(list(self._meta))
+
+    def nbytes(self) -> int:
+        return sum(size for _, _, size in self._meta.values())
+
+    def save(self, path: str) -> Dict[str, Any]:
+        """Hard-link (or copy) every original into `path`; returns the JSON-able index."""
+        os.makedirs(path, exist_ok=True)
+        index = {}
+        for image_id, (src, mime, size) in list(self._meta.items()):
+            _link_or_copy(src, os.path.join(path, image_id))
+            index[image_id] = [mime, size]
+        return index
+
+    def adopt(self, path: str, index: Dict[str, Any]) -> None:
+        """Take over images written by `save`; prepared variants are rebuilt on first use."""
+        for image_id, (mime, size) in index.items():
+            dst = os.path.join(self.root, image_id)
+            _link_or_copy(os.path.join(path, image_id), dst)
+            with self._lock:
+                self._meta[image_id] = (dst, mime, size)
+
+    def close(self) -> None:
+        self._meta.clear()
+        self._prepared.clear()
+        self._finalizer()
+
+
+def dhash(img: "Image.Image", size: int = 8) -> int:
+    """64-bit difference hash: robust to rescaling and recompression of the same logo."""
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            bits = (bits << 1) | (left > px[row * (size + 1) + col + 1])
+    return bits
+
+
+class ImageTriage:
+    """Ingest-time filter: drops tiny icons and collapses repeated images (logos) by dHash.
+
+    Images under `min_side` pixels on either side or `min_pixels` in area are dropped.
+    Byte-identical images are always duplicates. Otherwise a near match (same size, dHash
+    within `max_distance` bits) is only collapsed once that look has been seen on at least
+    `min_pages` distinct pages: the running-logo case. Two charts that merely look alike
+    (different values, same layout) each appear once and are both kept. A duplicate only
+    adds a back-reference (source, page) to its representative in `refs`.
+    """
+
+    def __init__(self, min_side: int = 48, min_pixels: int = 96 * 96, max_distance: int = 4, min_pages: int = 3) -> None:
+        self.min_side = min_side
+        self.min_pixels = min_pixels
+        self.max_distance = max_distance
+        self.min_pages = min_pages
+        self._hashes: List[Tuple[int, str]] = []  # (dhash, representative id)
+        self._digests: Dict[str, str] = {}  # content digest -> representative id
+        self._sizes: Dict[str, Tuple[int, int]] = {}  # representative id -> (w, h)
+        self._pages: Dict[str, Set[Tuple[str, Any]]] = {}  # representative id -> pages its look was seen on
+        self.refs: Dict[str, List[Tuple[str, Any]]] = {}
+        self.dropped_small = 0
+        self.dropped_duplicate = 0
+
+    def _duplicate(self, rep_id: str, source: str, page: Any) -> Tuple[str, Optional[str]]:
+        self.dropped_duplicate += 1
+        self.refs[rep_id].append((source, page))
+        return "duplicate", rep_id
+
+    def check(self, data: bytes, image_id: str, source: str, page: Any) -> Tuple[str, Optional[str]]:
+        """("small", None), ("duplicate", representative id) or ("keep", image_id)."""
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if digest in self._digests:
+            rep_id = self._digests[digest]
+            self._pages.setdefault(rep_id, set()).add((source, page))
+            return self._duplicate(rep_id, source, page)
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                w, h = img.size
+                if min(w, h) < self.min_side or w * h < self.min_pixels:
+                    self.dropped_small += 1
+                    return "small", None
+                h64 = dhash(img)
+        except Exception:
+            h64 = None  # undecodable: keep it rather than lose content
+        if h64 is not None:
+            for seen, rep_id in self._hashes:
+                if self._sizes.get(rep_id) == (w, h) and (seen ^ h64).bit_count() <= self.max_distance:
+                    pages = self._pages.setdefault(rep_id, set())
+                    pages.add((source, page))
+                    if len(pages) >= self.min_pages:  # a recurring look: logo, running banner
+                        return self._duplicate(rep_id, source, page)
+                    break  # alike but not (yet) recurring: keep this one as well
+            else:
+                self._hashes.append((h64, image_id))
+                self._sizes[image_id] = (w, h)
+                self._pages[image_id] = {(source, page)}
+        self._digests[digest] = image_id
+        self.refs[image_id] = [(source, page)]
+        return "keep", image_id
@@ -0,0 +1,158 @@
+import os
+import time
+import uuid
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Set
+
+
+COLLECTION_PREFIX = "rag-"
+IDLE_TTL_S = float(os.getenv("ENGINE_IDLE_TTL_S", "3600"))
+SWEEP_INTERVAL_S = float(os.getenv("ENGINE_SWEEP_INTERVAL_S", "300"))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def chroma_client() -> Any:
+    """The process-wide in-memory Chroma client every engine creates its collection in."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import chromadb
+            _client = chromadb.EphemeralClient()
+        return _client
+
+
+def collection_name(corpus_id: str, instance: Optional[str] = None) -> str:
+    """`rag-<corpus hash>-<instance>`: named by the corpus, unique per engine."""
+    return f"{COLLECTION_PREFIX}{corpus_id[:16]}-{instance or uuid.uuid4().hex[:8]}"
+
+
+def drop_collection(name: str) -> None:
+    if _client is None:  # no client yet, so no collection either
+        return
+    try:
+        _client.delete_collection(name)
+    except Exception:
+        pass  # already gone
+
+
+def current_session_id() -> Optional[str]:
+    """Streamlit session the caller runs in, if any."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx is not None else None
+    except Exception:
+        return None
+
+
+def session_alive(session_id: Optional[str]) -> bool:
+    """False only when Streamlit positively reports the session gone; unknown counts as alive."""
+    if session_id is None:
+        return True
+    try:
+        from streamlit.runtime import Runtime
+        if not Runtime.exists():
+            return True
+        return Runtime.instance()._session_mgr.get_session_info(session_id) is not None  # private API
+    except Exception:
+        return True
+
+
+class Sweeper:
+    """Background reclaimer of engines and Chroma collections nobody uses any more.
+
+    Every `interval` seconds it closes registered engines whose Streamlit session has ended
+    or that have been idle (`last_used`) for more than `idle_ttl` seconds, then drops any
+    `rag-*` collection in the shared client not claimed by a live engine (leftovers of
+    engines that died without `close()`). Engines still building are never touched.
+    """
+
+    def __init__(self, interval: float = SWEEP_INTERVAL_S, idle_ttl: float = IDLE_TTL_S) -> None:
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self._engines: "weakref.WeakSet[Any]" = weakref.WeakSet()
+        self._claimed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {"sweeps": 0, "engines_closed": 0, "collections_dropped": 0}
+
+    def claim(self, name: str) -> None:
+        with self._lock:
+            self._claimed.add(name)
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            self._claimed.discard(name)
+
+    def register(self, engine: Any) -> None:
+        with self._lock:
+            self._engines.add(engine)
+        self.start()
+
+    def unregister(self, engine: Any) -> None:
+        with self._lock:
+            self._engines.discard(engine)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self._thread = threading.Thread(target=self._run, name="engine-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[WARN] engine sweep failed: {e}")
+
+    def _expired(self, engine: Any, now: float) -> bool:
+        threads = (getattr(engine, "_stream_thread", None), getattr(engine, "_summary_thread", None))
+        building = any(t is not None and t.is_alive() for t in threads)
+        if engine.closing or building:
+            return False
+        if not session_alive(engine.session_id):
+            return True
+        return self.idle_ttl > 0 and now - engine.last_used > self.idle_ttl
+
+    def sweep(self) -> Dict[str, int]:
+        now = time.monotonic()
+        with self._lock:
+            engines: List[Any] = list(self._engines)
+        for engine in engines:
+            if self._expired(engine, now):
+                engine.close()
+                self.stats["engines_closed"] += 1
+
+        if _client is not None:
+            with self._lock:
+                claimed = set(self._claimed)
+            for col in _client.list_collections():
+                name = getattr(col, "name", col)  # Collection objects before chromadb 0.6, names after
+                if name.startswith(COLLECTION_PREFIX) and name not in claimed:
+                    drop_collection(name)
+                    self.stats["collections_dropped"] += 1
+        self.stats["sweeps"] += 1
+        return dict(self.stats)
+
+
+SWEEPER = Sweeper()
+
+
+def reclaim(name: str) -> None:
+    """Drop an engine's collection and its claim; safe to call more than once."""
+    drop_collection(name)
+    SWEEPER.release(name)
+
+
+def rename_collection(collection: Any, old: str, new: str) -> None:
+    """Move an engine's claim (and its Chroma collection, if any) from `old` to `new`."""
+    SWEEPER.claim(new)  # before the rename, so a sweep in between never sees it unclaimed
+    if collection is not None:
+        collection.modify(name=new)
+    SWEEPER.release(old)
@@ -0,0 +1,357 @@
+import io
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import pymupdf as fitz
+except ImportError:  # PyMuPDF < 1.24.3
+    import fitz
+import unstructured
+from unstructured.chunking.title import chunk_by_title
+from unstructured.partition.pdf import partition_pdf
+
+from engines.caches import PartitionCache
+
+
+# Shared by both engines; kept at module level so worker processes can import it.
+ELEMENT_KWARGS: Dict[str, Any] = dict(
+    infer_table_structure=False,   # big speed win; still keeps text
+    strategy="hi_res",             # OCR for scanned PDFs
+    extract_image_block_types=["Image"],
+    extract_image_block_to_payload=True,
+)
+CHUNK_KWARGS: Dict[str, Any] = dict(
+    max_characters=6000,
+    combine_text_under_n_chars=1500,
+    new_after_n_chars=4000,
+)
+PARTITION_KWARGS: Dict[str, Any] = dict(ELEMENT_KWARGS, chunking_strategy="by_title", **CHUNK_KWARGS)
+
+
+# Workers are spawned, not forked: the Streamlit server is multi-threaded, and a forked child
+# can inherit locks held by other threads at fork time and hang.
+_MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Text-layer pre-pass: a page is "text-native" when PyMuPDF finds enough embedded text, no
+# raster image larger than a small fraction of the page (logos and icons are fine), no table
+# and little vector drawing (charts). Only those skip hi_res, because "fast" emits no Table
+# elements and extracts no images; everything else keeps the full layout + OCR pass.
+TEXT_PAGE_MIN_CHARS = 200
+TEXT_PAGE_MAX_IMAGE_RATIO = 0.05
+TEXT_PAGE_MAX_DRAWING_RATIO = 0.05
+
+
+def cache_params(text_layer: bool = False) -> Dict[str, Any]:
+    """Everything that changes partition output; part of the partition cache key."""
+    return dict(
+        PARTITION_KWARGS,
+        text_layer=text_layer,
+        text_layer_rules=(TEXT_PAGE_MIN_CHARS, TEXT_PAGE_MAX_IMAGE_RATIO, TEXT_PAGE_MAX_DRAWING_RATIO, "tables") if text_layer else None,
+        unstructured_version=getattr(unstructured, "__version__", ""),
+    )
+
+
+def read_bytes(file_like: Any) -> bytes:
+    """Rewind a BytesIO / UploadedFile-like object and return its full content."""
+    try:
+        file_like.seek(0)
+    except Exception:
+        pass
+    data = file_like.read()
+    try:
+        file_like.seek(0)
+    except Exception:
+        pass
+    return data
+
+
+def partition_bytes(data: bytes, fname: str) -> Tuple[str, List[Any], float]:
+    """Partition one PDF. Returns (name, chunks, seconds); picklable for process pools."""
+    t0 = time.perf_counter()
+    chunks = partition_pdf(file=io.BytesIO(data), **PARTITION_KWARGS)
+    return fname, chunks, time.perf_counter() - t0
+
+
+def page_count(data: bytes) -> int:
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return doc.page_count
+
+
+def extract_pages(data: bytes, start: int, stop: int) -> bytes:
+    """Copy pages [start, stop) (0-based) into a standalone PDF."""
+    with fitz.open(stream=data, filetype="pdf") as src, fitz.open() as out:
+        out.insert_pdf(src, from_page=start, to_page=stop - 1)
+        return out.tobytes()
+
+
+def _drawing_area(page: Any) -> float:
+    """Page area covered by vector drawings (charts, diagrams); hairlines and rules excluded."""
+    area = 0.0
+    for d in page.get_drawings():
+        rect = fitz.Rect(d["rect"]) & page.rect
+        if rect.width > 2 and rect.height > 2:
+            area += abs(rect)
+    return area
+
+
+def _has_table(page: Any) -> bool:
+    try:
+        return bool(page.find_tables().tables)
+    except AttributeError:  # PyMuPDF < 1.23: no table finder, be conservative
+        return True
+
+
+def classify_pages(data: bytes, start: int = 0, stop: Optional[int] = None) -> List[bool]:
+    """For pages [start, stop): True where "fast" is lossless, False where hi_res is needed."""
+    native = []
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for page in doc.pages(start, doc.page_count if stop is None else stop):
+            area = abs(page.rect) or 1.0
+            chars = len(page.get_text("text").strip())
+            image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+            native.append(
+                chars >= TEXT_PAGE_MIN_CHARS
+                and image_area / area <= TEXT_PAGE_MAX_IMAGE_RATIO
+                and _drawing_area(page) / area <= TEXT_PAGE_MAX_DRAWING_RATIO
+                and not _has_table(page)
+            )
+    return native
+
+
+def partition_shard(
+    data: bytes, fname: str, start: int, stop: int, strategy: str = "hi_res"
+) -> Tuple[str, List[Any], float]:
+    """Partition pages [start, stop) of a PDF into raw (unchunked) elements.
+
+    `strategy="fast"` reads the embedded text layer (no OCR, no layout model).
+    Page numbers are shifted back to the page numbering of the full document.
+    """
+    t0 = time.perf_counter()
+    kwargs = dict(ELEMENT_KWARGS, strategy=strategy)
+    elements = partition_pdf(file=io.BytesIO(extract_pages(data, start, stop)), **kwargs)
+    for el in elements:
+        md = getattr(el, "metadata", None)
+        if md is not None:
+            md.page_number = (md.page_number or 1) + start
+    return fname, elements, time.perf_counter() - t0
+
+
+def _page_windows(n_pages: int, shard_pages: int) -> List[Tuple[int, int]]:
+    return [(p, min(p + shard_pages, n_pages)) for p in range(0, n_pages, shard_pages)]
+
+
+def _runs(native: List[bool], start: int) -> List[Tuple[int, int, str]]:
+    """Consecutive text-native / scanned pages as (start, stop, strategy), offset by `start`."""
+    runs: List[Tuple[int, int, str]] = []
+    first = 0
+    for p in range(1, len(native) + 1):
+        if p == len(native) or native[p] != native[first]:
+            runs.append((start + first, start + p, "fast" if native[first] else "hi_res"))
+            first = p
+    return runs
+
+
+def partition_window(
+    data: bytes, fname: str, start: int, stop: int, text_layer: bool = False
+) -> Tuple[str, List[Any], float, Dict[str, float]]:
+    """Partition pages [start, stop) into raw elements, classifying them first when `text_layer`.
+
+    The text-layer pre-pass runs here, in the worker, so the parent never blocks on it.
+    Text-native runs go through "fast", the rest through hi_res, in page order.
+    Returns (name, elements, seconds, split); `split` has pages and seconds per strategy and
+    the pre-pass seconds (`prepass_s`), all included in `seconds`.
+    """
+    t0 = time.perf_counter()
+    split: Dict[str, float] = {"fast": 0, "hi_res": 0, "fast_s": 0.0, "hi_res_s": 0.0, "prepass_s": 0.0}
+    runs = [(start, stop, "hi_res")]
+    if text_layer:
+        runs = _runs(classify_pages(data, start, stop), start) or runs
+        split["prepass_s"] = time.perf_counter() - t0
+    elements: List[Any] = []
+    for r_start, r_stop, strategy in runs:
+        _, els, secs = partition_shard(data, fname, r_start, r_stop, strategy)
+        elements.extend(els)
+        split[strategy] += r_stop - r_start
+        split[f"{strategy}_s"] += secs
+    return fname, elements, time.perf_counter() - t0, split
+
+
+def _record_split(stats: Dict[str, float], split: Dict[str, float]) -> None:
+    """Add one window's page split to `stats` and re-derive the net time the text layer saved.
+
+    `text_layer_saved_s` is what the text-native pages would have cost at the observed hi_res
+    rate, minus what they did cost and minus the whole pre-pass; negative when the pre-pass
+    cost more than it saved. Left out while no page has gone through hi_res (no rate yet).
+    """
+    stats["pages_text_native"] = stats.get("pages_text_native", 0) + split["fast"]
+    stats["pages_ocr"] = stats.get("pages_ocr", 0) + split["hi_res"]
+    stats["text_native_s"] = stats.get("text_native_s", 0.0) + split["fast_s"]
+    stats["ocr_s"] = stats.get("ocr_s", 0.0) + split["hi_res_s"]
+    stats["text_layer_prepass_s"] = stats.get("text_layer_prepass_s", 0.0) + split["prepass_s"]
+    if stats["pages_ocr"]:
+        would_cost = stats["pages_text_native"] * stats["ocr_s"] / stats["pages_ocr"]
+        stats["text_layer_saved_s"] = would_cost - stats["text_native_s"] - stats["text_layer_prepass_s"]
+
+
+def partition_files(
+    files: Sequence[Tuple[bytes, str]],
+    workers: int = 1,
+    shard_pages: int = 0,
+    cache: Optional[PartitionCache] = None,
+    text_layer: bool = False,
+    stats: Optional[Dict[str, float]] = None,
+) -> List[Tuple[str, List[Any], float, bool]]:
+    """Partition several PDFs, in a process pool when `workers > 1`.
+
+    With `shard_pages > 0`, documents longer than that are split into page windows that are
+    partitioned as separate tasks; their elements are stitched back in page order and chunked
+    `by_title` over the whole document, so chunk boundaries do not depend on the shard size.
+    With `text_layer`, each window's worker runs a PyMuPDF pre-pass and sends text-native
+    pages through the fast text extraction path and only scanned pages through hi_res OCR; the
+    stitched stream is chunked the same way, so callers see the same element shape. Page
+    split, pre-pass time and net time saved go to `stats` (see `_record_split`).
+    With a `cache`, documents seen before (same bytes, same parameters) are loaded from disk
+    and never reach the pool; fresh results are written back.
+    Results are (name, chunks, seconds, from_cache) in the same order as `files`, whatever
+    order the workers finish in. The reported seconds are summed over a file's shards.
+    """
+    cached: Dict[int, Tuple[List[Any], float]] = {}
+    keys: List[str] = []
+    if cache is not None:
+        params = cache_params(text_layer)
+        for i, (data, _) in enumerate(files):
+            t0 = time.perf_counter()
+            keys.append(cache.key(data, params))
+            hit = cache.get(keys[i])
+            if hit is not None:
+                cached[i] = (hit, time.perf_counter() - t0)
+
+    # (file index, fn, args) — one task per file, or one per page window
+    tasks: List[Tuple[int, Any, Tuple[Any, ...]]] = []
+    windowed = set()
+    for i, (data, fname) in enumerate(files):
+        if i in cached:
+            continue
+        n_pages = page_count(data) if text_layer or shard_pages > 0 else 0
+        if not text_layer and (shard_pages <= 0 or n_pages <= shard_pages):
+            tasks.append((i, partition_bytes, (data, fname)))
+            continue
+        windowed.add(i)
+        for start, stop in _page_windows(n_pages, shard_pages if shard_pages > 0 else max(n_pages, 1)):
+            tasks.append((i, partition_window, (data, fname, start, stop, text_layer)))
+
+    if not tasks:
+        outs = []
+    elif workers <= 1 or len(tasks) <= 1:
+        outs = [fn(*args) for _, fn, args in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=_MP_CONTEXT) as pool:
+            futures = [pool.submit(fn, *args) for _, fn, args in tasks]
+            outs = [f.result() for f in futures]
+
+    elements: List[List[Any]] = [[] for _ in files]
+    seconds: List[float] = [0.0 for _ in files]
+    for (i, _, _), out in zip(tasks, outs):
+        elements[i].extend(out[1])
+        seconds[i] += out[2]
+        if stats is not None and text_layer and len(out) > 3:
+            _record_split(stats, out[3])
+
+    results = []
+    for i, (_, fname) in enumerate(files):
+        if i in cached:
+            chunks, secs = cached[i]
+            results.append((fname, chunks, secs, True))
+            continue
+        chunks = chunk_by_title(elements[i], **CHUNK_KWARGS) if i in windowed else elements[i]
+        if cache is not None:
+            cache.put(keys[i], chunks, source=fname)
+        results.append((fname, chunks, seconds[i], False))
+    return results
+
+
+def iter_partition(
+    files: Sequence[Tuple[bytes, str]],
+    workers: int = 1,
+    batch_pages: int = 10,
+    cache: Optional[PartitionCache] = None,
+    text_layer: bool = False,
+    stats: Optional[Dict[str, float]] = None,
+) -> Iterator[Tuple[str, List[Any], int, float, bool]]:
+    """Streaming variant of `partition_files`: yield (name, chunks, pages, seconds, from_cache)
+    for each page batch as soon as it is partitioned, in completion order.
+
+    Batches are planned from the page count alone and submitted right away; the text-layer
+    pre-pass runs per batch inside its worker, and `stats` is updated as each batch lands.
+    Each batch is chunked `by_title` on its own, so chunks never span a batch boundary.
+    Once every batch of a file is in, the whole file is re-chunked and written to the cache,
+    so later (non-streaming) builds get exactly the `partition_files` result.
+    """
+    params = cache_params(text_layer)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_MP_CONTEXT) if workers > 1 else None
+    try:
+        # (file index, window index, pages, args)
+        tasks: List[Tuple[int, int, int, Tuple[Any, ...]]] = []
+        parts: Dict[int, List[Optional[List[Any]]]] = {}
+        keys: Dict[int, str] = {}
+        futures: Dict[Any, Tuple[int, int, int]] = {}
+        hits: List[Tuple[str, List[Any], int, float, bool]] = []
+        for i, (data, fname) in enumerate(files):
+            n_pages = page_count(data)
+            if cache is not None:
+                keys[i] = cache.key(data, params)
+                t0 = time.perf_counter()
+                hit = cache.get(keys[i])
+                if hit is not None:
+                    hits.append((fname, hit, n_pages, time.perf_counter() - t0, True))
+                    continue
+            windows = _page_windows(n_pages, max(1, batch_pages)) or [(0, n_pages)]
+            parts[i] = [None] * len(windows)
+            for w, (start, stop) in enumerate(windows):
+                args = (data, fname, start, stop, text_layer)
+                if pool is None:
+                    tasks.append((i, w, stop - start, args))
+                else:
+                    futures[pool.submit(partition_window, *args)] = (i, w, stop - start)
+        yield from hits  # indexed while the workers start on the rest
+
+        def finished(i: int, w: int, els: List[Any], split: Dict[str, float]) -> None:
+            parts[i][w] = els
+            if stats is not None and text_layer:
+                _record_split(stats, split)
+            if cache is not None and all(p is not None for p in parts[i]):
+                stitched = [el for p in parts[i] for el in p]
+                cache.put(keys[i], chunk_by_title(stitched, **CHUNK_KWARGS), source=files[i][1])
+
+        if pool is None:
+            for i, w, pages, args in tasks:
+                fname, els, secs, split = partition_window(*args)
+                finished(i, w, els, split)
+                yield fname, chunk_by_title(els, **CHUNK_KWARGS), pages, secs, False
+        else:
+            for fut in as_completed(futures):
+                i, w, pages = futures[fut]
+                fname, els, secs, split = fut.result()
+                finished(i, w, els, split)
+                yield fname, chunk_by_title(els, **CHUNK_KWARGS), pages, secs, False
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def split_elements(chunks: Iterable[Any]) -> Tuple[List[Any], List[Any], List[Any]]:
+    """Split the orig_elements of `by_title` chunks into (tables, texts, images)."""
+    tables, texts, images = [], [], []
+    for chunk in chunks:
+        if hasattr(chunk, "metadata") and getattr(chunk.metadata, "orig_elements", None):
+            for el in chunk.metadata.orig_elements:
+                t = str(type(el))
+                if "Table" in t:
+                    tables.append(el)
+                elif "Image" in t:
+                    images.append(el)
+                else:
+                    texts.append(el)
+    return tables, texts, images
@@ -0,0 +1,188 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable
+
+from engines.caches import corpus_hash
+
+try:
+    import psutil  # optional: accurate current RSS on every platform
+except Exception:
+    psutil = None
+
+
+POOL_BUDGET_MB = float(os.getenv("ENGINE_POOL_BUDGET_MB", "4096"))
+# Streamlit, layout/OCR models, allocator slack: counted against the budget, never evictable
+POOL_BASELINE_MB = float(os.getenv("ENGINE_POOL_BASELINE_MB", "1024"))
+
+
+def engine_bytes(engine: Any) -> int:
+    """Bytes an engine holds by its own `memory_report()`; 0 for engines without one."""
+    try:
+        return int(engine.memory_report()["total"])
+    except Exception:
+        return 0
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process (psutil, else /proc, else peak RSS)."""
+    if psutil is not None:
+        return int(psutil.Process().memory_info().rss)
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return int(peak if sys.platform == "darwin" else peak * 1024)  # bytes on macOS, KiB elsewhere
+    except Exception:
+        return 0
+
+
+class EnginePool:
+    """Process-wide LRU of built engines, shared by every Streamlit session.
+
+    Engines are keyed by `corpus_hash` of the uploaded files (order-independent), so the
+    same upload in another session or on another click reuses the built engine. Concurrent
+    requests for a corpus that is still being built wait for that one build. After each
+    build, when a streaming build finishes (the engine has grown since it was pooled) and on
+    every hit, least-recently-used engines are `close()`d while `baseline_mb` plus the pooled
+    engines' own `memory_report()` totals exceed `budget_mb`. (Process RSS is reported but
+    not budgeted on: closing an engine rarely returns its pages to the OS, so an RSS loop
+    would evict everything.) Engines still streaming their build, and the one just
+    requested, are never evicted.
+    Engines closed elsewhere (the idle sweeper) or whose build failed (`progress["error"]`)
+    are dropped on the next lookup and rebuilt.
+    """
+
+    def __init__(self, budget_mb: float = POOL_BUDGET_MB, baseline_mb: float = POOL_BASELINE_MB) -> None:
+        self.budget_bytes = int(budget_mb * 2**20)
+        self.baseline_bytes = int(baseline_mb * 2**20)
+        self._engines: "OrderedDict[str, Any]" = OrderedDict()  # least recently used first
+        self._building: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "joined_builds": 0, "build_errors": 0, "evictions": 0, "dropped_closed": 0, "dropped_failed": 0}
+
+    @staticmethod
+    def key(files_bytes: Iterable[bytes]) -> str:
+        return corpus_hash(files_bytes)
+
+    def get(self, key: str, build: Callable[[], Any]) -> Any:
+        """The pooled engine for `key`, calling `build()` (once across threads) on a miss."""
+        failed = None
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None and getattr(engine, "closing", getattr(engine, "closed", False)):
+                del self._engines[key]
+                self.stats["dropped_closed"] += 1
+                engine = None
+            if engine is not None and getattr(engine, "progress", {}).get("error"):
+                failed = self._engines.pop(key)  # broken or partial: rebuild rather than serve it
+                self.stats["dropped_failed"] += 1
+                engine = None
+            if engine is not None:
+                self._engines.move_to_end(key)
+                self.stats["hits"] += 1
+                if hasattr(engine, "touch"):
+                    engine.touch()
+            else:
+                pending = self._building.get(key)
+                if pending is None:
+                    pending = self._building[key] = Future()
+                    self.stats["misses"] += 1
+                    owner = True
+                else:
+                    self.stats["joined_builds"] += 1
+                    owner = False
+
+        if engine is not None:
+            self._enforce_budget(keep=key)  # engines may have grown since the last check
+            return engine
+        if failed is not None and hasattr(failed, "close"):
+            failed.close()
+        if not owner:
+            return pending.result()  # re-raises the builder's error
+
+        try:
+            engine = build()
+        except BaseException as e:
+            with self._lock:
+                del self._building[key]
+                self.stats["build_errors"] += 1
+            pending.set_exception(e)
+            raise
+        if hasattr(engine, "session_id"):
+            engine.session_id = None  # shared now: outlives the session that built it
+        if hasattr(engine, "on_stream_done"):  # measured again once fully built
+            engine.on_stream_done.append(lambda: self._enforce_budget(keep=key))
+        with self._lock:
+            self._engines[key] = engine
+            del self._building[key]
+        pending.set_result(engine)
+        self._enforce_budget(keep=key)
+        return engine
+
+    def pooled_bytes(self) -> Dict[str, int]:
+        with self._lock:
+            engines = list(self._engines.items())
+        return {key: engine_bytes(engine) for key, engine in engines}
+
+    def _enforce_budget(self, keep: str) -> None:
+        if self.budget_bytes <= 0:
+            return
+        sizes = self.pooled_bytes()
+        used = self.baseline_bytes + sum(sizes.values())
+        with self._lock:
+            candidates = [
+                key for key, engine in self._engines.items()  # least recently used first
+                if key != keep and not (getattr(engine, "_stream_thread", None) is not None and engine._stream_thread.is_alive())
+            ]
+        evicted = False
+        for key in candidates:
+            if used <= self.budget_bytes:
+                break
+            self.evict(key)
+            used -= sizes.get(key, 0)
+            self.stats["evictions"] += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def evict(self, key: str) -> None:
+        with self._lock:
+            engine = self._engines.pop(key, None)
+        if engine is not None and hasattr(engine, "close"):
+            engine.close()
+            print(f"Finished evict — {key[:16]}")
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = list(self._engines)
+        for key in keys:
+            self.evict(key)
+
+    def report(self) -> Dict[str, Any]:
+        """Hit/miss counters, pooled engines and process memory against the budget."""
+        with self._lock:
+            engines = list(self._engines.items())
+            building = len(self._building)
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["joined_builds"]
+        return {
+            **self.stats,
+            "hit_rate": round((self.stats["hits"] + self.stats["joined_builds"]) / lookups, 3) if lookups else 0.0,
+            "engines": len(engines),
+            "building": building,
+            "engine_bytes": sum(self.pooled_bytes().values()),
+            "baseline_bytes": self.baseline_bytes,
+            "budget_bytes": self.budget_bytes,
+            "rss_bytes": rss_bytes(),
+            "corpora": {key[:16]: getattr(engine, "file_names", []) for key, engine in reversed(engines)},  # most recent first
+        }
+
+
+ENGINE_POOL = EnginePool()
@@ -203,4 +203,12 @@ Format should be in the form of bullet points e.g. - As of Dec-24, the Company i
 Source: Please utilize the financial statements/annual reports for this section, as well as web search if required. Usually financial statements/annual reports have a section of debt/creditors/borrowings with such information 
 
 Please avoid internal debt information. These include loans from parent company, or group companies 
-"""
\ No newline at end of file
+"""
+
+image_caption_prompt = """
+You are indexing an image taken from a company's annual report or financial statements.
+Describe it in at most three sentences so it can be found by search and used as context.
+If it is a chart or graph, state the metric, the period covered, the key figures and the trend.
+If it is a table, list what it compares and its most important values.
+If it is a logo, photo or decoration, say so in a few words.
+"""
@@ -0,0 +1,161 @@
+import sys
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+
+KINDS = ("text", "table", "image")
+_NO_PAGE = -1
+
+
+class RecordStore(BaseStore[str, Document]):
+    """Docstore of parent chunks packed into parallel arrays and one shared UTF-8 buffer.
+
+    Per record only a type code, page number, source index and (offset, length) into the
+    UTF-8 text buffer are kept; source names are interned once. Metadata beyond source/type/page
+    (e.g. `image_ids`) lives in a side dict for the few records that have it. `Document`s
+    are built on `mget`, so no per-chunk Python objects stay alive between queries.
+    Overwritten or deleted records are masked; their text stays in the buffer.
+    `to_arrays` / `from_arrays` round-trip the columns through NumPy; a loaded buffer can be a
+    read-only memory map and is only copied on the next write.
+    """
+
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self._row: Dict[str, int] = {}
+        self._kind = array("b")
+        self._page = array("i")
+        self._source = array("i")
+        self._offset = array("q")
+        self._length = array("i")
+        self._alive = bytearray()
+        self.sources: List[str] = []
+        self._source_idx: Dict[str, int] = {}
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._buf: Any = bytearray()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def _text(self, row: int) -> str:
+        start = self._offset[row]
+        return bytes(self._buf[start:start + self._length[row]]).decode("utf-8")
+
+    def _append(self, key: str, doc: Document) -> None:
+        meta = dict(doc.metadata or {})
+        source = str(meta.pop("source", ""))
+        kind = meta.pop("type", "text")
+        page = meta.pop("page", None)
+        if source not in self._source_idx:
+            self._source_idx[source] = len(self.sources)
+            self.sources.append(source)
+        text = (doc.page_content or "").encode("utf-8")
+        if not isinstance(self._buf, bytearray):  # loaded from a snapshot: copy on first write
+            self._buf = bytearray(self._buf)
+
+        old = self._row.get(key)
+        if old is not None:
+            self._alive[old] = 0
+            self._extra.pop(old, None)
+        row = len(self.ids)
+        self.ids.append(key)
+        self._row[key] = row
+        self._kind.append(KINDS.index(kind) if kind in KINDS else 0)
+        self._page.append(_NO_PAGE if page is None else int(page))
+        self._source.append(self._source_idx[source])
+        self._offset.append(len(self._buf))
+        self._length.append(len(text))
+        self._alive.append(1)
+        if meta:
+            self._extra[row] = meta
+        self._buf += text
+
+    def count(self, kind: Optional[str] = None) -> int:
+        if kind is None:
+            return len(self)
+        code = KINDS.index(kind)
+        with self._lock:
+            return sum(1 for row in self._row.values() if self._kind[row] == code)
+
+    # ------------------------------ BaseStore ------------------------------
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        out: List[Optional[Document]] = []
+        with self._lock:
+            for key in keys:
+                row = self._row.get(key)
+                if row is None:
+                    out.append(None)
+                    continue
+                meta: Dict[str, Any] = {"source": self.sources[self._source[row]], "type": KINDS[self._kind[row]]}
+                if self._page[row] != _NO_PAGE:
+                    meta["page"] = self._page[row]
+                meta.update(self._extra.get(row, {}))
+                out.append(Document(page_content=self._text(row), metadata=meta))
+        return out
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        with self._lock:
+            for key, doc in key_value_pairs:
+                self._append(key, doc)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        with self._lock:
+            for key in keys:
+                row = self._row.pop(key, None)
+                if row is not None:
+                    self._alive[row] = 0
+                    self._extra.pop(row, None)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        for key in list(self._row):
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+    # ------------------------------- memory --------------------------------
+    def nbytes(self) -> Dict[str, int]:
+        arrays = (self._kind, self._page, self._source, self._offset, self._length)
+        return {
+            "text_buffer": len(self._buf) if isinstance(self._buf, bytearray) else 0,  # a loaded buffer is a shared mapping
+            "columns": sum(a.itemsize * len(a) for a in arrays) + len(self._alive),
+            "ids": sys.getsizeof(self.ids) + sys.getsizeof(self._row) + sum(sys.getsizeof(k) for k in self.ids),
+            "extra_metadata": sum(sys.getsizeof(m) for m in self._extra.values()),
+        }
+
+    # ------------------------------ snapshot -------------------------------
+    def to_arrays(self) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+        """Columns as NumPy arrays plus the JSON-able rest (sources, extra metadata)."""
+        with self._lock:
+            arrays = {
+                "ids": np.array(self.ids, dtype=str),
+                "kind": np.frombuffer(self._kind, dtype=np.int8).copy(),
+                "page": np.frombuffer(self._page, dtype=np.int32).copy(),
+                "source": np.frombuffer(self._source, dtype=np.int32).copy(),
+                "offset": np.frombuffer(self._offset, dtype=np.int64).copy(),
+                "length": np.frombuffer(self._length, dtype=np.int32).copy(),
+                "alive": np.frombuffer(bytes(self._alive), dtype=np.uint8),
+                "text": np.frombuffer(bytes(self._buf), dtype=np.uint8),
+            }
+            meta = {"sources": list(self.sources), "extra": {str(row): m for row, m in self._extra.items()}}
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> "RecordStore":
+        store = cls()
+        store.ids = arrays["ids"].tolist()
+        store._kind = array("b", np.asarray(arrays["kind"], dtype=np.int8).tobytes())
+        store._page = array("i", np.asarray(arrays["page"], dtype=np.int32).tobytes())
+        store._source = array("i", np.asarray(arrays["source"], dtype=np.int32).tobytes())
+        store._offset = array("q", np.asarray(arrays["offset"], dtype=np.int64).tobytes())
+        store._length = array("i", np.asarray(arrays["length"], dtype=np.int32).tobytes())
+        store._alive = bytearray(np.asarray(arrays["alive"], dtype=np.uint8).tobytes())
+        store._buf = memoryview(arrays["text"])  # zero-copy when `text` is memory-mapped
+        store._row = {key: row for row, key in enumerate(store.ids) if store._alive[row]}
+        store.sources = list(meta["sources"])
+        store._source_idx = {name: i for i, name in enumerate(store.sources)}
+        store._extra = {int(row): m for row, m in meta["extra"].items()}
+        return store
@@ -9,6 +9,7 @@ if str(repo_root) not in sys.path:
 
 # --- engine ---
 from engines.engine import HybridEngine
+from engines.hierarchy import focus
 
 # pdf_path = repo_root / "engines" / "report.pdf"
 # with open(pdf_path, "rb") as f:
@@ -65,7 +66,7 @@ def pdf_search(query: str) -> str:
     results = []
     for i, d in enumerate(docs[:3]):
         src = d.metadata.get("source", "unknown")
-        text = (d.page_content or "").strip().replace("\n", " ")[:300]
+        text = focus(d.page_content, d.metadata.get("match"), 300)  # the matched span, not the chunk head
         results.append(f"[{src}] {text}")
         print(f"[DEBUG] Snippet {i+1} from {src}: {text[:60]}...")
     output = "\n---\n".join(results)
@@ -0,0 +1,124 @@
+import asyncio
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional
+
+
+def _as_int(value: Any) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for key in ("retry-after-ms", "retry-after"):
+        value = headers.get(key)
+        if value is not None:
+            try:
+                return float(value) / (1000.0 if key.endswith("-ms") else 1.0)
+            except ValueError:
+                pass
+    return None
+
+
+def _is_rate_limit(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+# What the OpenAI SDK itself retries: timeouts, dropped connections, 408/409 and 5xx
+_TRANSIENT = ("APITimeoutError", "APIConnectionError", "InternalServerError", "TimeoutError")
+
+
+def _is_transient(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    if isinstance(status, int) and (status >= 500 or status in (408, 409)):
+        return True
+    return type(exc).__name__ in _TRANSIENT or isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+
+
+class AdaptiveScheduler:
+    """Runs async LLM jobs under a concurrency limit steered by OpenAI rate-limit headers.
+
+    Each job returns (result, headers). When `x-ratelimit-remaining-requests/-tokens` fall
+    under `low_water` of their limits the concurrency is halved; while both stay above
+    `high_water` it grows by one (AIMD). 429s halve the concurrency and are retried after
+    `retry-after`, or an exponential backoff with jitter, up to `max_retries` times; transient
+    errors (timeouts, connection errors, 5xx) get the same backoff without the halving.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 6,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        low_water: float = 0.1,
+        high_water: float = 0.5,
+    ) -> None:
+        self.concurrency = concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.low_water = low_water
+        self.high_water = high_water
+        self.stats: Dict[str, float] = {"calls": 0, "rate_limited": 0, "transient_errors": 0, "retries": 0}
+        self._in_flight = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def observe(self, headers: Optional[Mapping[str, Any]]) -> None:
+        if not headers:
+            return
+        fractions = []
+        for kind in ("requests", "tokens"):
+            remaining = _as_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            limit = _as_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            if remaining is not None and limit:
+                fractions.append(remaining / limit)
+        if not fractions:
+            return
+        if min(fractions) < self.low_water:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        elif min(fractions) > self.high_water:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+
+    async def _acquire(self) -> None:
+        async with self._cond:
+            while self._in_flight >= self.concurrency:
+                await self._cond.wait()
+            self._in_flight += 1
+
+    async def _release(self) -> None:
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    async def _run_one(self, job: Callable[[], Awaitable[Any]]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            try:
+                self.stats["calls"] += 1
+                result, headers = await job()
+                self.observe(headers)
+                return result
+            except Exception as exc:
+                rate_limited = _is_rate_limit(exc)
+                if not (rate_limited or _is_transient(exc)) or attempt == self.max_retries:
+                    return exc
+                self.stats["retries"] += 1
+                if rate_limited:
+                    self.stats["rate_limited"] += 1
+                    self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                else:
+                    self.stats["transient_errors"] += 1
+                delay = _retry_after(exc) or self.base_delay * (2 ** attempt)
+            finally:
+                await self._release()
+            await asyncio.sleep(delay * (1.0 + random.random() * 0.25))
+
+    async def run(self, jobs: List[Callable[[], Awaitable[Any]]]) -> List[Any]:
+        """Results in job order; a job that keeps failing yields its exception instead."""
+        self._cond = asyncio.Condition()
+        return await asyncio.gather(*(self._run_one(job) for job in jobs))
@@ -0,0 +1,49 @@
+import os
+import json
+import tempfile
+from typing import Any, Dict
+
+import numpy as np
+
+
+# Bump when the on-disk layout changes; older snapshots are then refused, not misread.
+SNAPSHOT_FORMAT = 1
+MANIFEST = "manifest.json"
+
+
+def save_arrays(path: str, prefix: str, arrays: Dict[str, np.ndarray]) -> None:
+    """One `.npy` per array (`{prefix}.{name}.npy`), each written atomically."""
+    for name, arr in arrays.items():
+        fd, tmp = tempfile.mkstemp(dir=path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            np.save(fh, np.asarray(arr), allow_pickle=False)
+        os.replace(tmp, os.path.join(path, f"{prefix}.{name}.npy"))
+
+
+def load_arrays(path: str, prefix: str, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """Arrays written by `save_arrays`, memory-mapped (read-only) unless `mmap=False`."""
+    arrays = {}
+    head = f"{prefix}."
+    for fname in os.listdir(path):
+        if fname.startswith(head) and fname.endswith(".npy"):
+            arrays[fname[len(head):-4]] = np.load(os.path.join(path, fname), mmap_mode="r" if mmap else None, allow_pickle=False)
+    return arrays
+
+
+def write_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    """Written last: a directory without a manifest is not a (complete) snapshot."""
+    fd, tmp = tempfile.mkstemp(dir=path, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        json.dump({"format": SNAPSHOT_FORMAT, **manifest}, fh)
+    os.replace(tmp, os.path.join(path, MANIFEST))
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(path, MANIFEST), encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"no engine snapshot at {path!r} (missing {MANIFEST})") from None
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"snapshot format {manifest.get('format')} is not supported (expected {SNAPSHOT_FORMAT})")
+    return manifest
@@ -39,13 +39,15 @@ load_dotenv(find_dotenv(), override=True)
 # GPT TOOLS 
 # @st.cache_resource(show_spinner=False)
 # def ocr_engine_cached_multi(files_bytes: Tuple[bytes, ...], files_names: Tuple[str, ...]):
-#     """Multi-file OCR mode via HybridEngine (idempotent + timed)."""
-#     pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
-#     engine = HybridEngine(pdf_streams)
-#     t0 = time.perf_counter(); engine.main(); build_s = time.perf_counter() - t0
-#     timings = getattr(engine, "timings", {})
-#     timings["total_build_s"] = build_s
-#     return engine.chain, engine.chain_with_sources, timings
+#     """Multi-file OCR mode via HybridEngine (idempotent + timed), shared through ENGINE_POOL."""
+#     def build():
+#         pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
+#         engine = HybridEngine(pdf_streams)
+#         t0 = time.perf_counter(); engine.main(); build_s = time.perf_counter() - t0
+#         engine.timings["total_build_s"] = build_s
+#         return engine
+#     engine = ENGINE_POOL.get(ENGINE_POOL.key(files_bytes), build)
+#     return engine.chain, engine.chain_with_sources, engine.timings
 
 # =====================================================
 
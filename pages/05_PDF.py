@@ -1,5 +1,6 @@
 from io import BytesIO
 from typing import Tuple, Annotated, TypedDict
+import os
 import time
 import streamlit as st
 import sys, pathlib
@@ -13,6 +14,9 @@ if str(repo_root) not in sys.path:
 
 # Engine
 from engines.engine import HybridEngine
+from engines.hierarchy import focus
+from engines.partition import page_count
+from engines.pool import ENGINE_POOL
 
 # LangGraph
 from langgraph.graph import StateGraph, START, END
@@ -24,15 +28,37 @@ from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
 
-# Cache builder
-# @st.cache_resource(show_spinner=False)  # disable while debugging
-def ocr_engine_cached_multi(files_bytes: Tuple[bytes, ...], files_names: Tuple[str, ...]):
-    pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
-    engine = HybridEngine(pdf_streams)
-    t0 = time.perf_counter(); engine.main(); build_s = time.perf_counter() - t0
-    timings = getattr(engine, "timings", {})
-    timings["total_build_s"] = build_s
-    return engine, timings
+def ocr_engine_streaming(files_bytes: Tuple[bytes, ...], files_names: Tuple[str, ...]) -> HybridEngine:
+    """Start a streaming build in the background; the engine is searchable after the first page batch.
+
+    Pooled (engines/pool.py): a corpus already built, or still streaming, is reused across sessions.
+    """
+    def build() -> HybridEngine:
+        pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
+        batch_pages = int(os.getenv("PDF_STREAM_BATCH_PAGES", "10"))
+        # One process per page batch at most, and a few at most: each worker loads its own layout/OCR models
+        windows = sum(-(-page_count(b) // batch_pages) for b in files_bytes)
+        workers = int(os.getenv("PDF_WORKERS", min(windows or 1, os.cpu_count() or 1, 4)))
+        engine = HybridEngine(pdf_streams, workers=workers, docstore=os.getenv("PDF_DOCSTORE", "memory"),
+                              vector_index=os.getenv("PDF_VECTOR_INDEX", "chroma"),
+                              vector_dtype=os.getenv("PDF_VECTOR_DTYPE", "float32"))
+        engine.start_streaming(batch_pages=batch_pages)
+        return engine
+
+    return ENGINE_POOL.get(ENGINE_POOL.key(files_bytes), build)
+
+@st.fragment(run_every=2)
+def build_progress(engine: HybridEngine):
+    p = engine.progress
+    total = max(p["pages_total"], 1)
+    st.progress(min(p["pages_indexed"] / total, 1.0), text=f"Pages indexed: {p['pages_indexed']} / {p['pages_total']}")
+    if p.get("error"):
+        st.error(f"Build failed: {p['error']}")
+    # Rerun the whole page when the index first becomes searchable and when it completes
+    stage = "done" if p["done"] else ("searchable" if engine.hybrid is not None else "indexing")
+    if stage != st.session_state.get("build_stage"):
+        st.session_state.build_stage = stage
+        st.rerun()
 
 # LangGraph builder
 memory = MemorySaver()
@@ -43,12 +69,17 @@ def build_graph(engine: HybridEngine):
     @tool
     def pdf_search(query: str) -> str:
         """Retrieve top snippets from the indexed PDFs for a query."""
-        docs = engine.hybrid.get_relevant_documents(query)
+        engine.touch()
+        with engine.in_use() as ok:  # an evicted engine closes only after this query
+            if not ok or engine.hybrid is None:  # closed, or first batch not indexed yet
+                return "NO_MATCH"
+            docs = engine.hybrid.get_relevant_documents(query)
         st.write(f"[DEBUG] pdf_search query: {query}")
         st.write(f"[DEBUG] Retrieved docs: {len(docs) if docs else 0}")
         if not docs:
             return "NO_MATCH"
-        return "\n---\n".join([d.page_content[:500] for d in docs[:3]])
+        # Parents are whole by_title chunks: show the span around the sentence window that matched
+        return "\n---\n".join([focus(d.page_content, d.metadata.get("match"), 500) for d in docs[:3]])
         
         
     
@@ -129,6 +160,7 @@ def main():
         "ocr_engine": None,
         "graph": None,
         "ocr_timings": {},
+        "build_stage": None,
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -151,27 +183,56 @@ def main():
         files_bytes: Tuple[bytes, ...] = tuple(f.getvalue() for f in pdf_files)
         files_names: Tuple[str, ...] = tuple(f.name for f in pdf_files)
 
+        if st.session_state.ocr_engine is not None and st.session_state.ocr_engine.closing:
+            st.session_state.processed = False  # evicted from the pool or swept: fetch / rebuild
+
         if not st.session_state.get("processed", False):
-            with st.spinner("Building OCR (hybrid) index across all PDFs..."):
-                try:
-                    engine, timings = ocr_engine_cached_multi(files_bytes, files_names)
-                    st.session_state.ocr_engine = engine
-                    st.session_state.ocr_timings = timings
-                    st.session_state.graph = build_graph(engine)
-                    if "thread_id" not in st.session_state or not st.session_state.thread_id:
-                        import time
-                        st.session_state.thread_id = f"ui-{int(time.time())}"
-                    st.success("OCR index ready.")
-                    st.json(st.session_state.get("ocr_timings", {})) # to be removed later
-                    st.write("Texts:", len(engine.texts), "Tables:", len(engine.tables), "Images:", len(engine.images)) # to be removed later
-                    st.session_state.processed = True
-                except Exception as e:
-                    st.error("Build failed")
-                    st.exception(e)
-                    return
+            try:
+                engine = ocr_engine_streaming(files_bytes, files_names)
+                st.session_state.ocr_engine = engine
+                st.session_state.ocr_timings = engine.timings  # filled in as the build progresses
+                st.session_state.graph = build_graph(engine)
+                st.session_state.build_stage = "indexing"
+                st.session_state.vector_report = None
+                if "thread_id" not in st.session_state or not st.session_state.thread_id:
+                    import time
+                    st.session_state.thread_id = f"ui-{int(time.time())}"
+                st.session_state.processed = True
+            except Exception as e:
+                st.error("Build failed")
+                st.exception(e)
+                return
+
+        engine = st.session_state.ocr_engine
+        if engine.progress["done"]:
+            if engine.progress.get("error"):
+                st.error(f"Build failed: {engine.progress['error']}")
+                if st.button("Retry build"):  # the pool drops the failed engine and builds again
+                    st.session_state.processed = False
+                    st.rerun()
+            else:
+                st.success("OCR index ready.")
+            st.write("Texts:", engine.store.count("text"), "Tables:", engine.store.count("table"), "Images:", len(engine.image_store)) # to be removed later
+        else:
+            build_progress(engine)
+            if engine.hybrid is not None:
+                st.info("Answers use the pages indexed so far; they improve as indexing continues.")
 
         st.subheader("Timings")
         st.json(st.session_state.get("ocr_timings", {}))
+        if engine.progress["done"]:
+            with st.expander("Memory (bytes)"):
+                st.json(engine.memory_report())
+                # Flat index only (PDF_VECTOR_INDEX=flat); scores sample queries against the whole index: on demand only
+                if engine.vector_index == "flat" and st.button("Measure vector index quality"):
+                    st.session_state.vector_report = engine.vector_report()
+                if st.session_state.get("vector_report"):
+                    st.json(st.session_state.vector_report)
+
+        if engine.hybrid is None:
+            if not engine.progress["done"]:
+                st.info("Indexing the first pages…")
+            return
 
         question = st.text_input("Ask a question about your PDFs:")
         if question:
@@ -32,6 +32,8 @@ from io import BytesIO
 from typing import Tuple
 import time
 from engines.hybrig_eng_enhanced import HybridEngine
+from engines.pool import ENGINE_POOL
+from engines.lifecycle import SWEEPER
 
 
 load_dotenv(find_dotenv(), override=True)
@@ -39,13 +41,15 @@ load_dotenv(find_dotenv(), override=True)
 # GPT TOOLS 
 # @st.cache_resource(show_spinner=False)
 # def ocr_engine_cached_multi(files_bytes: Tuple[bytes, ...], files_names: Tuple[str, ...]):
-#     """Multi-file OCR mode via HybridEngine (idempotent + timed)."""
-#     pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
-#     engine = HybridEngine(pdf_streams)
-#     t0 = time.perf_counter(); engine.main(); build_s = time.perf_counter() - t0
-#     timings = getattr(engine, "timings", {})
-#     timings["total_build_s"] = build_s
-#     return engine.chain, engine.chain_with_sources, timings
+#     """Multi-file OCR mode via HybridEngine (idempotent + timed), shared through ENGINE_POOL."""
+#     def build():
+#         pdf_streams = tuple((BytesIO(b), n) for b, n in zip(files_bytes, files_names))
+#         engine = HybridEngine(pdf_streams)
+#         t0 = time.perf_counter(); engine.main(); build_s = time.perf_counter() - t0
+#         engine.timings["total_build_s"] = build_s
+#         return engine
+#     engine = ENGINE_POOL.get(ENGINE_POOL.key(files_bytes), build)
+#     return engine.chain, engine.chain_with_sources, engine.timings
 
 # =====================================================
 
@@ -154,6 +158,14 @@ with st.sidebar.expander("Script Mod", expanded=False):
     )
 
 
+with st.sidebar.expander("Engine pool", expanded=False):
+    st.write('Built PDF engines shared across sessions. Least-recently-used ones are evicted while baseline + engine memory (memory_report) exceeds the budget; RSS is shown for reference.')
+    st.json(ENGINE_POOL.report())
+    st.json(SWEEPER.stats)
+    if st.button("Evict all engines", use_container_width=True, key="pool_clear"):
+        ENGINE_POOL.clear()
+        st.rerun()
+
 with st.sidebar.expander("Actions", expanded=False):
     st.write('List of possible actions by chat:')
     st.write('1. Create company profile.')